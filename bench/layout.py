@@ -0,0 +1,267 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function
+
+# Times each phase of the layout pipeline over synthetic histories, built
+# straight into the commit database with no Git involved. Run it as
+#
+#	PYTHONPATH=src python3 bench/layout.py [options] [shape…]
+#
+# For each shape and size, the time of each phase is printed, then the scaling
+# exponent between consecutive sizes: 1 means linear, 2 means quadratic. As
+# rendering a row costs as much as the layout is wide, the width is printed too.
+# The default sizes take a minute or two, as printing wide shapes grows faster
+# than linearly; larger ones, up to a million commits, are asked with -s
+
+import getopt
+import math
+import os
+import random
+import sys
+import time
+
+from githistorian.node import NodeDB
+from githistorian.graph import _bind_children, _print_graph
+from githistorian.column import Column
+from githistorian.component import unroll as component_unroll
+
+# Commits are numbered from the oldest, each naming its parents among those
+# that came before; tips are the commits still without children
+class History:
+
+	def __init__ (self, seed):
+		self.parents = []
+		self.random = random.Random(seed)
+
+	def __len__ (self):
+		return len(self.parents)
+
+	def commit (self, *parents):
+		self.parents.append([e for e in parents if e >= 0])
+		return len(self.parents) - 1
+
+	# Records are added as git-log would print them, children first, named as
+	# hashes are
+	def load (self, tips):
+
+		db = NodeDB()
+		for node in reversed(range(len(self.parents))):
+			db.put_message(db.add_node('%040x' % node, ['%040x' % e for e in self.parents[node]]), ['commit %x' % node])
+
+		db.drop_missing_refs()
+		return db.drop_missing_heads(['%040x' % e for e in tips]), db
+
+# A single branch, each commit on top of the previous one
+def linear (size, seed):
+
+	h = History(seed)
+	tip = -1
+	while len(h) < size: tip = h.commit(tip)
+
+	return h.load([tip])
+
+# Many feature branches grow side by side and are merged back into the trunk
+# every now and then, then they start over from the new trunk
+def parallel (size, seed, branches=32):
+
+	h = History(seed)
+	trunk = h.commit()
+	tips = [trunk] * branches
+
+	while len(h) < size:
+
+		index = h.random.randrange(branches)
+
+		if h.random.random() < 0.05:
+			trunk = h.commit(trunk, tips[index])
+			tips[index] = trunk
+		else: tips[index] = h.commit(tips[index])
+
+	return h.load([trunk] + tips)
+
+# Every few commits, a bunch of single-commit branches forks from the trunk and
+# all of them are merged back at once
+def octopus (size, seed, width=8):
+
+	h = History(seed)
+	trunk = h.commit()
+
+	while len(h) < size:
+		trunk = h.commit(trunk)
+		tips = [h.commit(trunk) for i in range(width)]
+		trunk = h.commit(*tips)
+
+	return h.load([trunk])
+
+# Two branches that keep merging each other at the same time
+def crisscross (size, seed):
+
+	h = History(seed)
+	a = b = h.commit()
+
+	while len(h) < size:
+		a, b = h.commit(a), h.commit(b)
+		if h.random.random() < 0.3: a, b = h.commit(a, b), h.commit(b, a)
+
+	return h.load([a, b])
+
+# Topic branches fork from some recent point of the trunk, get merged into one
+# of many maintainer branches, which are merged into the trunk from time to
+# time, as a kernel-like history does
+def kernel (size, seed, maintainers=16):
+
+	h = History(seed)
+	trunk = [h.commit()]
+	tips = [trunk[-1]] * maintainers
+
+	while len(h) < size:
+
+		index = h.random.randrange(maintainers)
+		dice = h.random.random()
+
+		if dice < 0.1:
+			trunk.append(h.commit(trunk[-1], tips[index]))
+			tips[index] = trunk[-1]
+
+		elif dice < 0.2:
+			trunk.append(h.commit(trunk[-1]))
+
+		else:
+			topic = h.random.choice(trunk[-200:])
+			for i in range(h.random.randint(1, 20)): topic = h.commit(topic)
+			tips[index] = h.commit(tips[index], topic)
+
+	return h.load([trunk[-1]] + tips)
+
+# Several unrelated histories, as orphan branches are, each with a few
+# feature branches merged back into its own trunk
+def forest (size, seed, trees=8, branches=4):
+
+	h = History(seed)
+	heads = []
+
+	for tree in range(trees):
+
+		trunk = h.commit()
+		tips = [trunk] * branches
+
+		while len(h) < size * (tree + 1) // trees:
+
+			index = h.random.randrange(branches)
+
+			if h.random.random() < 0.1:
+				trunk = h.commit(trunk, tips[index])
+				tips[index] = trunk
+			else: tips[index] = h.commit(tips[index])
+
+		heads.extend([trunk] + tips)
+
+	return h.load(heads)
+
+SHAPES = [linear, parallel, octopus, crisscross, kernel, forest]
+PHASES = ['bind', 'row', 'column', 'print']
+
+# Runs the whole pipeline as deploy does, timing each phase; rows are printed
+# to the null device
+def run (heads, db):
+
+	timings = []
+
+	def lap ():
+		now = time.time()
+		timings.append(now - lap.clock)
+		lap.clock = now
+
+	lap.clock = time.time()
+
+	db.clear()
+	_bind_children(heads, db)
+	lap()
+
+	db.clear()
+	component_unroll(heads, db, False)
+	lap()
+
+	db.clear()
+	width = Column(heads, db).unroll()
+	lap()
+
+	stdout = sys.stdout
+	with open(os.devnull, 'w') as sys.stdout:
+		try: _print_graph(db, width, False, False, None, 0, 0)
+		finally: sys.stdout = stdout
+	lap()
+
+	return timings, width + 1
+
+def exponent (small, large, size, other):
+	if small <= 0 or large <= 0: return float('nan')
+	return math.log(large / small) / math.log(float(other) / size)
+
+def _print_help ():
+
+	print('Usage: %s [options] [shape…]' % sys.argv[0])
+	print()
+	print(' -s<N,…>, --sizes<N,…> : number of commits of each history, 5000,20000 by default')
+	print(' -r<N>, --repeat<N>    : keeps the best of N runs')
+	print(' -x<E>, --max-exponent<E> : fails when any phase scales worse than E')
+	print()
+	print('Shapes: %s' % ', '.join([e.__name__ for e in SHAPES]))
+
+def main ():
+
+	sizes = [5000, 20000]
+	repeat = 1
+	limit = None
+
+	try:
+		optlist, args = getopt.gnu_getopt(sys.argv[1:], 'hs:r:x:',
+			['help', 'sizes=', 'repeat=', 'max-exponent='])
+	except getopt.GetoptError as err:
+		_print_help()
+		return 2
+
+	for key, value in optlist:
+		if key in ('-h', '--help'):
+			_print_help()
+			return 0
+		elif key in ('-s', '--sizes'):
+			sizes = [int(e) for e in value.split(',')]
+		elif key in ('-r', '--repeat'):
+			repeat = int(value)
+		elif key in ('-x', '--max-exponent'):
+			limit = float(value)
+
+	shapes = dict((e.__name__, e) for e in SHAPES)
+	selected = [shapes[e] for e in args] if args else SHAPES
+	failed = False
+
+	print('%-10s %8s %s %7s' % ('shape', 'commits', ' '.join(['%9s' % e for e in PHASES]), 'width'))
+
+	for shape in selected:
+
+		results = []
+		for size in sizes:
+
+			best = None
+			for i in range(repeat):
+				heads, db = shape(size, 0)
+				timings, width = run(heads, db)
+				if best is None: best = timings
+				else: best = [min(e) for e in zip(best, timings)]
+
+			results.append((size, best))
+			print('%-10s %8d %s %7d' % (shape.__name__, size, ' '.join(['%8.3fs' % e for e in best]), width))
+			sys.stdout.flush()
+
+		for (size, small), (other, large) in zip(results, results[1:]):
+
+			exponents = [exponent(a, b, size, other) for a, b in zip(small, large)]
+			print('%-10s %8s %s' % ('', 'x%d' % (other // size), ' '.join(['%9.2f' % e for e in exponents])))
+
+			if limit is not None and any([e > limit for e in exponents]):
+				failed = True
+
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
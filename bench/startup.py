@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function
+
+# Measures how long githistorian takes to start, over the bare interpreter,
+# and fails when it goes over budget. Run it as
+#
+#	PYTHONPATH=src python3 bench/startup.py [options]
+#
+# Each command is run many times and the fastest run is kept, as any slower one
+# only adds the noise of the machine. The modules of the package are then listed
+# with their own import time, as -X importtime tells
+
+import getopt
+import subprocess
+import sys
+import time
+
+# Startup is measured for these commands, against an interpreter doing nothing;
+# the entry point is called as the installed script does
+_ENTRY = 'from githistorian.githistorian import tell_the_story; tell_the_story()'
+COMMANDS = [
+	('version', ['-c', _ENTRY, '--version']),
+	('help', ['-c', _ENTRY, '--help']),
+	('full import', ['-c', 'import githistorian.githistorian, githistorian.graph, githistorian.hunter.history']),
+]
+
+# Milliseconds each command may take over the bare interpreter
+BUDGET = {'version': 20.0, 'help': 20.0, 'full import': 50.0}
+
+def measure (args, runs):
+
+	timings = []
+	for i in range(runs):
+		start = time.time()
+		subprocess.check_call([sys.executable] + args, stdout=subprocess.DEVNULL)
+		timings.append(time.time() - start)
+
+	return min(timings) * 1000.0
+
+# Own import time of each module of the package, in microseconds
+def import_times (module):
+
+	args = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module]
+	output = subprocess.check_output(args, stderr=subprocess.STDOUT).decode('utf-8')
+
+	result = []
+	for line in output.split('\n'):
+		token = line.split('|')
+		if len(token) != 3: continue
+		name = token[2].strip()
+		if not name.startswith('githistorian'): continue
+		result.append((int(token[0].split(':')[1]), int(token[1]), name))
+
+	return result
+
+def _print_help ():
+
+	print('Usage: %s [options]' % sys.argv[0])
+	print()
+	print(' -n<N>, --runs<N>    : runs each command N times')
+	print(' -s<F>, --scale<F>   : multiplies every budget by F, for slower machines')
+
+def main ():
+
+	runs = 20
+	scale = 1.0
+
+	try:
+		optlist, args = getopt.gnu_getopt(sys.argv[1:], 'hn:s:', ['help', 'runs=', 'scale='])
+	except getopt.GetoptError as err:
+		_print_help()
+		return 2
+
+	for key, value in optlist:
+		if key in ('-h', '--help'):
+			_print_help()
+			return 0
+		elif key in ('-n', '--runs'):
+			runs = int(value)
+		elif key in ('-s', '--scale'):
+			scale = float(value)
+
+	# Warming up the bytecode cache
+	for name, args in COMMANDS: measure(args, 1)
+
+	bare = measure(['-c', 'pass'], runs)
+	print('%-12s %8.1fms' % ('interpreter', bare))
+
+	failed = False
+	for name, args in COMMANDS:
+
+		overhead = measure(args, runs) - bare
+		budget = BUDGET[name] * scale
+		verdict = 'ok' if overhead <= budget else 'OVER BUDGET'
+		print('%-12s %+8.1fms (budget %.1fms) %s' % (name, overhead, budget, verdict))
+
+		if overhead > budget: failed = True
+
+	print()
+	print('%10s %10s module' % ('self', 'cumulative'))
+	for own, cumulative, name in import_times('githistorian.githistorian'):
+		print('%8dus %8dus %s' % (own, cumulative, name))
+
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
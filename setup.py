@@ -13,6 +13,5 @@ setup(
 	package_dir={'':'src/'},
 	packages=find_packages(where='src'),
 	package_data={'': ['VERSION']},
-	install_requires=['bintrees'],
 	scripts=['bin/githistorian']
 )
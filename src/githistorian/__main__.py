@@ -1,5 +1,7 @@
 
+import sys
+
 from .githistorian import tell_the_story
 
-tell_the_story()
+sys.exit(tell_the_story())
 
@@ -0,0 +1,73 @@
+# -*- encoding: utf-8 -*-
+
+from collections import namedtuple
+
+from .option import Option
+
+# Each row of the layout, from top to bottom: the commit, its line in the whole
+# layout, its column, its parents, the lines of its message and the cells of
+# the graph to its left, as layout.Column tuples holding glyphs and colors
+Record = namedtuple('Record', 'commit line column parents message cells')
+
+# Builds the options as the command line would, from the names of the
+# attributes of Option; targets are given as the order
+def options (targets=(), **kwargs):
+
+	opt = Option()
+	opt.order = list(targets)
+
+	for key, value in kwargs.items():
+		if not hasattr(opt, key) or key == 'order':
+			raise TypeError('Unknown option %s' % key)
+		setattr(opt, key, value)
+
+	return opt
+
+# Yields the rows of the history of the current repo as records, with no ANSI
+# drawing at all. Rows are laid out as they are consumed: all at once, then
+# one by one, unless progressive is set, when each row comes out as soon as it
+# settles, though still after the whole history is read. Flipping vertically needs every row before the first one. Without
+# messages, only the relations between commits are read from Git
+def story (targets=(), messages=True, **kwargs):
+
+	from .githistorian import find_targets
+	from .hunter.history import hunt as history_hunt, load_messages
+
+	opt = options(targets, **kwargs)
+	if not messages: opt.lazy = True
+
+	found = find_targets(opt)
+	if not found: raise RuntimeError('Not a repo')
+	gitdir, targets = found
+
+	roots, history = history_hunt(opt, targets, opt.limit, gitdir)
+
+	if messages and opt.lazy: load = lambda nodes: load_messages(opt, history, nodes)
+	else: load = None
+
+	return records(opt, roots, history, load)
+
+# Lays out a history already loaded, yielding its rows as records
+def records (opt, roots, history, load=None):
+
+	from . import graph
+
+	if opt.progressive and not (opt.hflip or opt.vflip):
+		graph._bind_children(roots, history)
+		history.clear()
+		window = graph._lay_stream(opt, roots, history, load)
+
+	else:
+		first, width = graph.lay_out(opt, roots, history)
+		window = graph._lay_window(history, width, opt.hflip, opt.vflip, load, opt.skip, opt.rows)
+
+	result = _make_records(history, window, opt.skip)
+	if opt.vflip: result = reversed(list(result))
+
+	return result
+
+def _make_records (history, window, skip):
+
+	for line, (node, cells) in enumerate(window, skip):
+		yield Record(history.name[node], line, history.column[node],
+			history.names(history.parents(node)), history.lines(node), cells)
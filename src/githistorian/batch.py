@@ -0,0 +1,219 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function
+
+import io
+import os
+import shlex
+import sys
+import time
+import traceback
+
+from subprocess import CalledProcessError
+
+from .option import Option, parse as parse_cmd_args
+
+# Many repos are told in one run, by a pool of worker processes, so that the
+# interpreter starts and the package is loaded only once. Each line of the
+# batch file names a repo, where its story goes and its own options and
+# targets, which add to those of the command line:
+#
+#	<repo> <output> [options] [targets…]
+#
+# Stories meant for the standard output are written whole, in the order of the
+# batch file. A failing repo only fails its own line, and a summary of every
+# line, with its time, comes out on the standard error at the end
+
+# A single line of the batch file; paths are made absolute before any worker
+# changes its directory
+class Job:
+
+	def __init__ (self, number, repo, output, args):
+		self.number = number
+		self.repo = os.path.abspath(repo)
+		self.output = output if output == '-' else os.path.abspath(output)
+		self.args = args
+
+# What a job left behind: the story itself only if meant for the standard
+# output, and the report of its phases if asked
+class Result:
+
+	def __init__ (self, job):
+		self.job = job
+		self.error = None
+		self.commits = 0
+		self.time = 0.0
+		self.story = None
+		self.report = None
+
+# The output of a job is created only as the story starts, once its history is
+# hunted, so that a failing repo leaves no empty file behind
+class Output(io.RawIOBase):
+
+	def __init__ (self, path):
+		self.path = path
+		self.file = None
+
+	def writable (self):
+		return True
+
+	def open (self):
+		if self.file is None: self.file = open(self.path, 'wb')
+
+	def write (self, data):
+		self.open()
+		return self.file.write(data)
+
+	def close (self):
+		if self.file: self.file.close()
+		io.RawIOBase.close(self)
+
+# Empty lines and comments are skipped; a line without an output is an error
+def load_jobs (filename):
+
+	jobs = []
+	errors = []
+
+	with open(filename, 'r') as ifd:
+		for number, line in enumerate(ifd, 1):
+
+			token = shlex.split(line, comments=True)
+			if len(token) == 0: continue
+
+			if len(token) < 2: errors.append((number, line.strip()))
+			else: jobs.append(Job(number, token[0], token[1], token[2:]))
+
+	return jobs, errors
+
+def _tell (job, base):
+
+	from .githistorian import tell
+	from . import timing
+
+	result = Result(job)
+
+	sink = None
+	stdout = sys.stdout
+	cwd = os.getcwd()
+
+	start = time.time()
+
+	try:
+
+		# Preferences are read from the repo, as if run there. Whatever the
+		# parser prints, as the help for a bad option, is not a story
+		os.chdir(job.repo)
+		sys.stdout = io.StringIO()
+		try: opt = parse_cmd_args(job.args)
+		finally: sys.stdout = stdout
+		if not opt: raise ValueError('Bad options %s' % ' '.join(job.args))
+		opt = Option().override(base).override(opt)
+		if opt.timings: timing.enable(memory=opt.memory)
+
+		sink = io.BytesIO() if job.output == '-' else Output(job.output)
+		sys.stdout = io.TextIOWrapper(sink, encoding='utf-8', write_through=True)
+
+		history = tell(opt)
+		if history is None: raise ValueError('Not a repo')
+		result.commits = history.stats()[1]
+
+		sys.stdout.flush()
+		if job.output == '-': result.story = sink.getvalue()
+		else: sink.open()
+
+	# Only unexpected errors deserve a trace
+	except Exception as err:
+		result.error = '%s: %s' % (type(err).__name__, err)
+		if not isinstance(err, (ValueError, EnvironmentError, CalledProcessError)):
+			traceback.print_exc()
+
+	finally:
+		timings = timing.disable()
+		if timings:
+			report = io.StringIO()
+			timings.report(report)
+			result.report = report.getvalue()
+
+		result.time = time.time() - start
+
+		if sys.stdout is not stdout:
+			sys.stdout.detach()
+			sys.stdout = stdout
+		if sink: sink.close()
+		os.chdir(cwd)
+
+	return result
+
+# Options of the command line reach the workers once, as they start
+_base = None
+
+def _start_worker (base):
+	global _base
+	_base = base
+
+def _run_job (job):
+	return _tell(job, _base)
+
+def _print_summary (results, errors, elapsed, ofd=sys.stderr):
+
+	ofd.write('%-40s %-8s %10s %10s\n' % ('repo', 'status', 'commits', 'time'))
+
+	for number, line in errors:
+		ofd.write('%-40s %-8s line %d: %s\n' % ('', 'failed', number, line))
+
+	failed = len(errors)
+	for result in results:
+
+		status = 'failed' if result.error else 'ok'
+		ofd.write('%-40s %-8s %10d %9.3fs\n' % (result.job.repo, status, result.commits, result.time))
+
+		if result.error:
+			failed += 1
+			ofd.write('  %s\n' % result.error)
+
+		if result.report:
+			for line in result.report.splitlines(): ofd.write('  %s\n' % line)
+
+	ofd.write('%d repos, %d failed, %.3fs\n' % (len(results) + len(errors), failed, elapsed))
+	return failed
+
+# Each story is written as soon as its job is over, in the order of the
+# batch file. Returns the exit status, which fails if any line did
+def run (opt):
+
+	start = time.time()
+	jobs, errors = load_jobs(opt.batch)
+
+	base = Option().override(opt)
+	base.batch = False
+	base.jobs = 0
+
+	workers = min(opt.jobs or os.cpu_count() or 1, len(jobs))
+	if workers < 2:
+		_start_worker(base)
+		results = map(_run_job, jobs)
+		pool = None
+
+	else:
+		from multiprocessing import Pool
+		pool = Pool(workers, _start_worker, (base,))
+		results = pool.imap(_run_job, jobs)
+
+	done = []
+	out = getattr(sys.stdout, 'buffer', sys.stdout)
+
+	try:
+		for result in results:
+
+			if result.story:
+				out.write(result.story)
+				out.flush()
+
+			done.append(result)
+
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+	failed = _print_summary(done, errors, time.time() - start)
+	return 1 if failed else 0
@@ -0,0 +1,211 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import pickle
+
+from array import array
+from subprocess import CalledProcessError
+
+from .node import NodeDB
+from . import timing
+
+# Bumped whenever the stored layout changes its meaning
+_VERSION = 3
+
+# The whole database is stored, but for the children, which are bound again
+# only for new commits, and the messages, which are loaded as their rows are
+# displayed. The text only holds those of fake nodes
+_STATE = ('name', 'known', 'text', 'message_first', 'message_size',
+	'parent_first', 'parent_count', 'parent_store',
+	'column', 'border', 'row', 'top', 'bottom',
+	'line', 'grid', 'lowest', 'inverted', 'size', 'fake')
+
+def _get_path (gitdir):
+	return os.path.join(gitdir, 'githistorian.layout')
+
+# Only options that change which commits are selected or where they are
+# placed invalidate the layout; flipping the display horizontally or
+# vertically does not
+def _get_key (opt):
+	return (_VERSION, tuple(opt.order), bool(opt.heads), bool(opt.tags),
+		bool(opt.remotes), bool(opt.match), bool(opt.mingle), bool(opt.flip),
+		bool(opt.rtl))
+
+def _read (gitdir, opt):
+
+	try:
+		with open(_get_path(gitdir), 'rb') as ifd:
+			stored = pickle.load(ifd)
+	except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+		return None
+
+	if not isinstance(stored, dict) or stored.get('key') != _get_key(opt): return None
+	return stored
+
+# Hunts the history of the targets on top of the one stored by a previous run,
+# if any. Returns the roots, the history, the first node of the stored chain,
+# the mask of nodes already laid out, if any, and whether the stored layout is
+# stale, as it is unless the same tips were found with no new commit
+def hunt (opt, targets, gitdir):
+
+	from .hunter.history import hunt as history_hunt
+
+	with timing.phase('cache load'):
+		stored = _read(gitdir, opt)
+		resumed = _resume(stored, opt, targets) if stored else None
+
+	if resumed: return resumed
+
+	with timing.phase('parse'):
+		roots, history = history_hunt(opt, targets, False, gitdir)
+
+	if stored:
+		with timing.phase('cache load'):
+			below, done = restore(_get_chain(stored), opt, history)
+	else: below, done = -1, None
+
+	return roots, history, below, done, True
+
+# The stored database is taken as it is, and extended with the commits the
+# targets reach past the stored tips
+def _resume (stored, opt, targets):
+
+	if len(stored['line']) == 0: return None
+
+	db = NodeDB()
+	for name in _STATE: setattr(db, name, stored[name])
+
+	size = len(db.name)
+	db.child_first = array('i', [0]) * size
+	db.child_count = array('i', [0]) * size
+	db.done = bytearray(size)
+
+	tips = stored['tips']
+	extended = extend(opt, db, targets, tips)
+	if not extended: return None
+
+	roots, done, nodes = extended
+	return roots, db, stored['first'], done, len(nodes) > 0 or targets != tips
+
+# Git walks only the commits the targets reach past the tips of a database
+# already laid out. Every tip must still be reached, being a target or the
+# parent of a new commit, otherwise some ref may have been rewritten and the
+# history is to be hunted anew. Children are bound again for the new commits
+# alone. Returns the roots, the mask of nodes already laid out and the new
+# nodes, or nothing
+def extend (opt, db, targets, tips):
+
+	from .hunter.history import hunt_new
+
+	size = len(db.name)
+
+	if targets == tips: nodes = []
+	else:
+		try: nodes = hunt_new(opt, targets, tips, db)
+		except CalledProcessError: return None
+		if nodes is None: return None
+
+	reached = set(targets)
+	for node in nodes: reached.update(db.names(db.parents(node)))
+	if any([e not in reached for e in tips]): return None
+
+	roots = db.drop_missing_heads(targets)
+	if len(roots) != len(targets): return None
+
+	timing.count('new commits', len(nodes))
+
+	db.child_first = array('i', [0]) * len(db.name)
+	db.child_count = array('i', [0]) * len(db.name)
+
+	done = bytearray(b'\x01') * size + bytearray(len(db.done) - size)
+	return roots, done, nodes
+
+# The stored chain, as restore takes it
+def _get_chain (stored):
+
+	line = stored['line']
+	name = stored['name']
+
+	return {
+		'key': stored['key'],
+		'chain': [name[e] for e in line],
+		'column': array('i', [stored['column'][e] for e in line]),
+		'border': array('i', [stored['border'][e] for e in line]),
+		'row': stored['row'][line[0]] if len(line) else 0,
+	}
+
+# Every stored commit must still be in the database, otherwise some ref was
+# rewritten and the whole layout is dropped. Returns the first node of the
+# stored chain and the mask of nodes already laid out, or nothing if there is
+# no usable layout
+def restore (stored, opt, db):
+
+	if stored.get('key') != _get_key(opt): return -1, None
+
+	nodes = array('i')
+	for name in stored['chain']:
+		node = db.name.find(name)
+		if node < 0 or not db.has(node): return -1, None
+		nodes.append(node)
+
+	if len(nodes) == 0: return -1, None
+
+	done = bytearray(len(db.done))
+	column = stored['column']
+	border = stored['border']
+	row = stored['row']
+	previous = -1
+
+	for i, node in enumerate(nodes):
+
+		db.set_column(node, column[i])
+		db.set_border(node, border[i])
+		db.row[node] = row + i
+
+		db.top[node] = previous
+		if previous >= 0: db.bottom[previous] = node
+		previous = node
+
+		done[node] = 1
+
+	db.line = nodes
+	return nodes[0], done
+
+# Stores the whole database, as laid out with the chain starting at first,
+# replacing the old one. Messages must not be loaded yet
+def save (gitdir, opt, db, roots, first):
+
+	stored = dict([(name, getattr(db, name)) for name in _STATE])
+	stored['key'] = _get_key(opt)
+	stored['tips'] = db.names(roots)
+	stored['first'] = first
+
+	path = _get_path(gitdir)
+	with open(path + '.tmp', 'wb') as ofd:
+		pickle.dump(stored, ofd, pickle.HIGHEST_PROTOCOL)
+	os.rename(path + '.tmp', path)
+
+# Commits are recorded by name, so that the layout can be restored into another
+# database holding the same history
+def capture (opt, db, first):
+
+	chain = []
+	column = array('i')
+	border = array('i')
+
+	node = first
+	while node >= 0:
+		chain.append(db.name[node])
+		column.append(db.column[node])
+		border.append(db.border[node])
+		node = db.bottom[node]
+
+	stored = {
+		'key': _get_key(opt),
+		'chain': chain,
+		'column': column,
+		'border': border,
+		'row': db.row[first] if first >= 0 else 0,
+	}
+
+	return stored
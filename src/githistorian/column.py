@@ -1,57 +1,64 @@
 
-import bintrees
+from array import array
+from bisect import bisect_left
 
-class VisitOrder:
+from .visit import VisitOrder
+from . import timing
+
+# Each node placed on a column reserves the vertical span from its own row down
+# to the row of its lowest parent, as the arrows from the parents run up along
+# the column. Spans on the same column never overlap, so each column keeps them
+# sorted by their start, and a new span fits if it does not overlap either the
+# one right above or the one right below, both found by binary search
+class Grid:
 
 	def __init__ (self):
-		self.content = []
+		self.store = []
+		self.probes = 0
+		self.inserts = 0
 
-	def has_more (self):
-		return len(self.content)
+	def at (self, index):
+		while len(self.store) <= index:
+			self.store.append((array('i'), array('i'), array('i')))
+		return self.store[index]
 
-	def push (self, arg):
-		if len(arg) == 0: return
-		self.content.extend(arg)
+	def fits (self, column, start, end):
 
-	def pop (self):
-		try: return self.content.pop(0)
-		except: return None
+		self.probes += 1
+		starts, ends, nodes = self.at(column)
+		index = bisect_left(starts, start)
 
-	def show (self):
-		return '    [%s]' % ', '.join([e[:7] for e in self.content])
+		# The span above must end before this one starts…
+		if index > 0 and ends[index - 1] > start: return False
 
-class Grid:
+		# … and the span below must start after this one ends
+		if index < len(starts) and starts[index] < end: return False
 
-	def __init__ (self):
-		self.store = {}
+		return True
 
-	def at (self, index):
-		try:
-			return self.store[index]
-		except:
-			#self.store[index] = bintrees.RBTree()
-			self.store[index] = bintrees.BinaryTree()
-			return self.store[index]
-
-	def add (self, column, row, name):
-		t = self.at(column)
-		t.insert(row, name)
-
-	def remove (self, column, row):
-		t = self.at(column)
-		t.remove(row)
-
-	def upper (self, column, row):
-		try:
-			key, value = self.at(column).prev_item(row)
-			return value
-		except KeyError: return None
-
-	def lower (self, column, row):
-		try:
-			key, value = self.at(column).succ_item(row)
-			return value
-		except KeyError: return None
+	# Returns the first column, at or to the right of the given one, that can
+	# hold the span, and reserves the span on it
+	def allocate (self, column, start, end, node):
+
+		while not self.fits(column, start, end): column += 1
+
+		starts, ends, nodes = self.at(column)
+		index = bisect_left(starts, start)
+		self.inserts += 1
+		starts.insert(index, start)
+		ends.insert(index, end)
+		nodes.insert(index, node)
+
+		return column
+
+	# Yields, for each column, the node whose span runs across the given row
+	# from above, if any
+	def crossing (self, row):
+
+		for column, (starts, ends, nodes) in enumerate(self.store):
+			index = bisect_left(starts, row)
+			if index > 0 and ends[index - 1] >= row:
+				yield column, nodes[index - 1]
 
 class Column:
 
@@ -68,108 +75,203 @@ class Column:
 	def update_width (self, value):
 		self.width = max(self.width, value)
 
-	def find_column_for_head (self, name):
+	# The row of the lowest parent of each node is computed only once, before
+	# any column is assigned. Parents that ended up above their child, when the
+	# child dropped down, are recorded too, as their arrows are never closed.
+	# Nodes restored from a previous run keep what it computed, as their parents
+	# never change: only the nodes past them, all new, are looked at
+	def compute_lowest (self, known=None):
+
+		db = self.history
 
-		target = self.history.at(name)
+		if known is None:
+			first = 0
+			self.lowest = array('i', db.row)
+			db.inverted = []
+
+		else:
+			first = len(known)
+			self.lowest = known
+			self.lowest.extend(db.row[first:])
+
+		for node in range(first, len(db.row)):
+			for parent in db.parents(node):
+				if db.row[parent] > self.lowest[node]:
+					self.lowest[node] = db.row[parent]
+				elif db.row[parent] < db.row[node]:
+					db.inverted.append((node, parent))
+
+	def place (self, node, column):
+
+		column = self.grid.allocate(column, self.history.row[node], self.lowest[node], node)
+		self.history.set_column(node, column)
+		self.update_width(column)
+
+	def find_column_for_head (self, node):
 
 		# Start at the immediate right of previous head
-		previous = self.heads[self.heads.index(name) - 1]
-		column = self.history.at(previous).column + 1
-
-		while 1:
-			self.grid.add(column, target.row, 'MARKER')
-			if self.lower_check(target, column) and self.upper_check(target, column):
-				self.grid.add(column, target.row, name)
-				target.set_column(column)
-				self.update_width(column)
-				break
-
-			self.grid.remove(column, target.row)
-			column += 1
-		return
-
-	# This checks whether the target row overlaps with any arrow between
-	# the upper node on the column and its parents
-	def upper_check (self, target, column):
-
-		upper = self.grid.upper(column, target.row)
-		if not upper: return True
-		parents = self.history.at(upper).parent
-		if len(parents) == 0: return True
-		lowest = max([self.history.at(e).row for e in parents])
-		return lowest <= target.row
-
-	# This checks whether the row of the following node on column overlaps
-	# with any arrow between the target and its parents
-	def lower_check (self, target, column):
-
-		lower = self.grid.lower(column, target.row)
-		if not lower: return True
-		if len(target.parent) == 0: return True
-		lowest = max([self.history.at(e).row for e in target.parent])
-		return lowest <= self.history.at(lower).row
-
-	def find_column_for_parents (self, name):
-
-		target = self.history.at(name)
+		previous = self.heads[self.heads.index(node) - 1]
+		self.place(node, self.history.column[previous] + 1)
+
+	def find_column_for_parents (self, node):
+
+		db = self.history
 
 		# Parents are processed in row order, from lower to upper
-		target.parent.sort(key=lambda e: self.history.at(e).row, reverse=True)
+		db.sort_parents(node, key=lambda e: db.row[e], reverse=True)
 
-		for parent in [self.history.at(e) for e in target.parent]:
+		for parent in db.parents(node):
 
 			# If a parent has already a column, just push its border
-			if parent.has_column():
-				parent.set_border(target.column)
+			if db.has_column(parent):
+				db.set_border(parent, db.column[node])
 				continue
 
-			column = self.history.select_starting_column(parent.child)
-			while 1:
-				self.grid.add(column, parent.row, 'MARKER')
+			self.place(parent, db.select_starting_column(db.children(parent)))
+
+	# Nodes already placed by a previous run keep their columns, and reserve
+	# their spans before any other node is placed
+	def seed (self):
+
+		db = self.history
+		spans = {}
 
-				if self.upper_check(parent, column) and self.lower_check(parent, column):
-					self.grid.add(column, parent.row, parent.name)
-					parent.set_column(column)
-					self.update_width(column)
-					break
+		for node in range(len(db.column)):
+			if db.column[node] < 0: continue
+			spans.setdefault(db.column[node], []).append((db.row[node], self.lowest[node], node))
 
-				self.grid.remove(column, parent.row)
-				column += 1
-		return
+		for column, span in spans.items():
+			span.sort()
+			starts, ends, nodes = self.grid.at(column)
+			starts.extend([e[0] for e in span])
+			ends.extend([e[1] for e in span])
+			nodes.extend([e[2] for e in span])
+			self.update_width(column)
 
-	def unroll (self, flip):
+	def unroll (self):
+
+		db = self.history
 
 		self.width = -1
-		self.grid = Grid()
 
-		# The order starts for the named heads
-		order = VisitOrder()
-		if flip: self.heads.reverse()
+		# A grid restored from a previous run already holds the spans of the
+		# nodes it placed, the rightmost column of which is the width
+		if db.grid is None:
+			self.grid = Grid()
+			self.compute_lowest()
+			self.seed()
+
+		else:
+			self.grid = db.grid
+			self.grid.probes = self.grid.inserts = 0
+			self.compute_lowest(db.lowest)
+			self.width = len(self.grid.store) - 1
+
+		# The order starts for the named heads, always in the given order
+		order = VisitOrder(False)
 		order.push(self.heads)
+		heads = set(self.heads)
 
 		while order.has_more():
 
-			name = order.pop()
-			target = self.history.at(name)
+			node = order.pop()
 
 			# No node is processed more than once
-			if target.done: continue
+			if db.done[node]: continue
 
 			# If a node is a named head and has not yet a column assigned, it
 			# must look for a valid column on its own
-			if target.name in self.heads and not target.has_column():
-				self.find_column_for_head (name)
+			if node in heads and not db.has_column(node):
+				self.find_column_for_head (node)
 
 			# The node assigns a column to each of its parents, in order,
 			# ensuring each starts off on a valid position
-			self.find_column_for_parents (name)
+			self.find_column_for_parents (node)
 
 			# Parents are added to the order, then the node is done
-			order.push(self.history.skip_if_done(target.parent))
-			target.done = 1
+			order.push(db.skip_if_done(db.parents(node)))
+			db.done[node] = 1
+
+		# The grid is kept, to find the arrows running across any row, and
+		# stored along the lowest rows by the cache
+		db.grid = self.grid
+		db.lowest = self.lowest
+
+		timing.count('column probes', self.grid.probes)
+		timing.count('grid inserts', self.grid.inserts)
 
 		return self.width
 
-def unroll (heads, history, flip):
-	return Column(heads, history).unroll(flip)
+# Columns can also be assigned while lines are still coming, from top to
+# bottom. Every span above the current line is then known to start earlier, so
+# a column is free as long as no node placed on it still waits for a parent
+# below. Each node takes the first free column, starting from the leftmost one
+# of its children, and holds it until all its parents have been placed
+class Stream:
+
+	def __init__ (self, heads, history):
+
+		self.heads = dict((node, index) for index, node in enumerate(heads))
+		self.order = heads
+		self.history = history
+
+		size = len(history.done)
+		self.waiting = array('i', [0]) * size
+		self.placed = bytearray(size)
+
+		self.holder = array('i')
+		self.width = -1
+		self.probes = 0
+
+	def release (self, node):
+
+		db = self.history
+
+		# Children whose last missing parent is this node leave their column
+		for child in db.children(node):
+			if not self.placed[child]: continue
+			self.waiting[child] -= 1
+			if self.waiting[child] == 0: self.holder[db.column[child]] = -1
+
+	def select (self, node):
+
+		db = self.history
+
+		children = [db.column[e] for e in db.children(node) if self.placed[e]]
+		if len(children): return min(children)
+
+		# A head with no children above starts at the immediate right of the
+		# previous head, if that is already placed
+		index = self.heads.get(node, 0)
+		if index and self.placed[self.order[index - 1]]:
+			return db.column[self.order[index - 1]] + 1
+
+		return 0
+
+	def place (self, node):
+
+		db = self.history
+
+		self.release(node)
+
+		start = column = self.select(node)
+		while column < len(self.holder) and self.holder[column] >= 0: column += 1
+		self.probes += column - start + 1
+		while len(self.holder) <= column: self.holder.append(-1)
+
+		db.set_column(node, column)
+		for child in db.children(node):
+			if self.placed[child]: db.set_border(node, db.column[child])
+
+		self.placed[node] = 1
+		self.waiting[node] = len([e for e in set(db.parents(node)) if not self.placed[e]])
+		if self.waiting[node]: self.holder[column] = node
+
+		self.width = max(self.width, column)
+		return column
+
+def unroll (heads, history):
+	return Column(heads, history).unroll()
 
+def stream (heads, history):
+	return Stream(heads, history)
@@ -0,0 +1,188 @@
+# -*- encoding: utf-8 -*-
+
+import os
+
+from array import array
+from bisect import bisect_right
+
+from .row import Row, unroll as row_unroll
+from . import timing
+
+# Histories sharing no commit, as orphan branches are, can have their rows laid
+# out apart, each in a worker process, then merged back into one chain. Columns
+# are still assigned over the whole history, as nodes from different histories
+# share the same columns
+
+# Workers pay off only when there is enough work besides the largest history
+_MIN_SHARED = 1 << 15
+
+# Workers are forked, so that they read the history of the parent as it is,
+# with nothing to copy; set only while they run
+_history = None
+
+# Groups the heads by the weakly connected component they reach. Each node is
+# marked by the first head reaching it, and heads meeting on a node are joined.
+# Returns the heads of each component, in order, and how many nodes it has
+def split (heads, history):
+
+	db = history
+	owner = array('i', [-1]) * len(db.done)
+	group = list(range(len(heads)))
+	size = [0] * len(heads)
+
+	def find (index):
+		while group[index] != index:
+			group[index] = group[group[index]]
+			index = group[index]
+		return index
+
+	for index, head in enumerate(heads):
+
+		nodes = [head]
+		while len(nodes):
+
+			node = nodes.pop()
+
+			if owner[node] >= 0:
+				other, mine = find(owner[node]), find(index)
+				if other != mine: group[mine] = other
+				continue
+
+			owner[node] = index
+			size[index] += 1
+			nodes.extend(db.parents(node))
+
+	components = {}
+	for index, head in enumerate(heads):
+		members, count = components.setdefault(find(index), ([], [0]))
+		members.append(head)
+		count[0] += size[index]
+
+	return [(members, count[0]) for members, count in components.values()]
+
+# Lays out the rows of a single component on the history of the parent. Returns
+# the nodes by line, their rows, the visit of each head and the drop-downs
+def _lay_rows (job):
+
+	heads, rtl = job
+	db = _history
+
+	row = Row(heads, db, rtl)
+	visits = row.unroll_heads(heads)
+
+	line = array('i')
+	node = row.first
+	while node >= 0:
+		line.append(node)
+		node = db.bottom[node]
+
+	return line, array('i', [db.row[e] for e in line]), visits, row.drops
+
+# Only forking workers can share the history, so none is used otherwise. A
+# worker of a batch cannot start workers of its own
+def _get_context ():
+
+	workers = os.cpu_count() or 1
+	if workers < 2: return None, 0
+
+	import multiprocessing
+	if 'fork' not in multiprocessing.get_all_start_methods(): return None, 0
+	if multiprocessing.current_process().daemon: return None, 0
+
+	return multiprocessing.get_context('fork'), workers
+
+def _map_jobs (context, workers, history, jobs):
+
+	global _history
+	_history = history
+
+	pool = context.Pool(min(workers, len(jobs)))
+	try: return pool.map(_lay_rows, jobs, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+		_history = None
+
+# Lays out the rows as row.unroll does, without mingling, each component in a
+# worker process when there is enough of them; history must be clear
+def unroll (heads, history, flip, rtl=False):
+
+	db = history
+
+	heads = list(reversed(heads)) if flip else list(heads)
+	heads = db.skip_if_done(heads)
+
+	context, workers = _get_context()
+	if context is None: return row_unroll(heads, db, False, False, -1, rtl)
+
+	components = split(heads, db)
+	sizes = sorted([e[1] for e in components])
+	if sum(sizes[:-1]) < _MIN_SHARED: return row_unroll(heads, db, False, False, -1, rtl)
+
+	timing.count('components', len(components))
+
+	# The largest components go first, not to be left for last
+	components.sort(key=lambda e: e[1], reverse=True)
+	results = _map_jobs(context, workers, db, [(e[0], rtl) for e in components])
+
+	owner = {}
+	for number, (component, size) in enumerate(components):
+		for head in component: owner[head] = number
+
+	return _merge(heads, db, owner, results)
+
+# Components are visited one head at a time, so the rows laid during the
+# visit of each head are taken from its own component, in order. Rows are
+# shifted as if a single counter ran across all visits
+def _merge (heads, history, owner, results):
+
+	db = history
+	db.line = array('i')
+
+	cursor = [0] * len(results)
+	visit = [0] * len(results)
+	before = [-1] * len(results)
+
+	row = -1
+	last = -1
+	drops = sum([e[3] for e in results])
+
+	for head in heads:
+
+		number = owner[head]
+		line, rows, visits, _ = results[number]
+
+		end, tail, dropped = visits[visit[number]]
+		visit[number] += 1
+		start, before[number] = before[number], end
+		shift = row - start
+
+		# A head laid last by the previous visit stays where it is
+		if dropped >= 0 and dropped == last:
+			drops -= 1
+			shift -= 1
+
+		first = cursor[number]
+		cursor[number] = bisect_right(rows, end, first)
+
+		for node, value in zip(line[first:cursor[number]], rows[first:cursor[number]]):
+			db.row[node] = value + shift
+		db.line.extend(line[first:cursor[number]])
+
+		if end + shift > row:
+			row = end + shift
+			last = tail
+
+	timing.count('drop-downs', drops)
+
+	# Binding top and bottom nodes together
+	line = db.line
+	for index in range(1, len(line)):
+		db.bottom[line[index - 1]] = line[index]
+		db.top[line[index]] = line[index - 1]
+
+	if len(line) == 0: return -1
+
+	db.top[line[0]] = -1
+	db.bottom[line[-1]] = -1
+	return line[0]
@@ -0,0 +1,289 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function
+
+import io
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+
+from collections import OrderedDict
+from subprocess import CalledProcessError
+
+from .option import parse as parse_cmd_args
+
+# Size of the chunks moved between client and daemon
+_CHUNK_SIZE = 1 << 16
+
+# Messages are loaded again at least this often, even if no ref moved, so that
+# their relative dates never grow too old
+_MAX_AGE = 60
+
+# Views kept in memory; the least recently used one goes first
+_MAX_VIEWS = 8
+
+# A history laid out for one repo, as selected by one set of options; messages
+# are loaded as their rows are displayed, and kept until they are too old. The
+# text up to fixed holds those of fake nodes, which never age
+class View:
+
+	def __init__ (self, targets, roots, history, width, first, fixed, loaded=None):
+		self.targets = targets
+		self.roots = roots
+		self.history = history
+		self.width = width
+		self.first = first
+		self.fixed = fixed
+		self.time = loaded or time.time()
+
+	def expire (self):
+		self.history.drop_messages(self.fixed)
+		self.time = time.time()
+
+class Daemon:
+
+	def __init__ (self):
+		self.views = OrderedDict()
+
+	# Only options that change which commits are loaded, where they are placed
+	# or how their messages look select a different view; flipping the layout
+	# or moving the window does not
+	def _get_key (self, gitdir, opt):
+		return (os.path.abspath(gitdir), tuple(opt.order), opt.heads, opt.tags,
+			opt.remotes, opt.match, opt.limit, opt.mingle, opt.rtl, opt.flip, opt.pretty,
+			tuple(opt.exclude), tuple(opt.paths), opt.since, opt.until, opt.author,
+			opt.first_parent)
+
+	# Errors and timings, if asked, go to the given stream, which is the
+	# standard error of the client when it could be passed along. Returns the
+	# exit status of the client
+	def answer (self, args, errors=None):
+
+		from . import timing
+
+		errors = errors or sys.stderr
+
+		opt = parse_cmd_args(args)
+		if not opt: return 0
+
+		if opt.timings: timing.enable(memory=opt.memory)
+
+		try: self.tell(opt)
+		except (ValueError, CalledProcessError) as err:
+			print(err, file=errors)
+			return 1
+
+		finally:
+			timings = timing.disable()
+			if timings: timings.report(errors)
+
+		return 0
+
+	def tell (self, opt):
+
+		from .githistorian import find_targets, print_stats
+		from .graph import render
+
+		# Messages are always loaded lazily, and the layout is kept in memory
+		# instead of being stored or streamed
+		opt.lazy = True
+		opt.cache = False
+		opt.progressive = False
+
+		found = find_targets(opt)
+		if not found:
+			print('Not a repo')
+			return
+		gitdir, targets = found
+
+		key = self._get_key(gitdir, opt)
+		view = self.views.pop(key, None)
+
+		# Any moved ref changes the targets, and the view is refreshed
+		if view is None or view.targets != targets:
+			view = self.refresh(opt, gitdir, targets, view)
+		if time.time() - view.time > _MAX_AGE: view.expire()
+
+		self.views[key] = view
+		while len(self.views) > _MAX_VIEWS: self.views.popitem(last=False)
+
+		if opt.verbose: print_stats(opt, targets, view.roots, view.history)
+		render(opt, view.history, view.width)
+
+	# Only the commits new to the previous history of the same view are walked,
+	# and placed on top of its layout, along with their messages. Should some
+	# ref have been rewritten, the history is read again, and the previous
+	# layout restored on it as far as it still holds. A limited or filtered
+	# history is never extended, as it has fake nodes and parents cut off
+	def refresh (self, opt, gitdir, targets, old):
+
+		from .hunter.history import hunt as history_hunt, is_filtered
+		from .graph import lay_out
+		from .cache import extend, restore, capture
+
+		stored = None
+		if old and not (opt.limit or is_filtered(opt)):
+
+			db = old.history
+			extended = extend(opt, db, targets, db.names(old.roots))
+			if extended:
+				roots, done, nodes = extended
+				first, width = lay_out(opt, roots, db, old.first, done)
+				return View(targets, roots, db, width, first, old.fixed, old.time)
+
+			stored = capture(opt, db, old.first)
+
+		roots, history = history_hunt(opt, targets, opt.limit, gitdir)
+
+		if stored: below, done = restore(stored, opt, history)
+		else: below, done = -1, None
+
+		first, width = lay_out(opt, roots, history, below, done)
+		return View(targets, roots, history, width, first, len(history.text))
+
+	# Each request is a single line holding the working directory and the
+	# arguments of the client, which may come along its standard error and a
+	# pipe for the exit status; everything printed goes back to the client
+	def handle (self, connection):
+
+		# A broken request does not take the daemon down either
+		try: request, errors, status = _receive(connection)
+		except (ValueError, IOError, OSError):
+			traceback.print_exc()
+			return
+
+		code = 1
+
+		ofd = connection.makefile('wb')
+
+		stdout = sys.stdout
+		sys.stdout = io.TextIOWrapper(ofd, encoding='utf-8', write_through=True)
+		cwd = os.getcwd()
+
+		try:
+			os.chdir(request['cwd'])
+			code = self.answer(request['args'], errors)
+			sys.stdout.flush()
+
+		# Nor does a client going away
+		except (IOError, OSError) as err:
+			if not isinstance(err, BrokenPipeError): traceback.print_exc()
+		except Exception:
+			traceback.print_exc()
+
+		finally:
+			sys.stdout.detach()
+			sys.stdout = stdout
+			os.chdir(cwd)
+			if errors: errors.close()
+			ofd.close()
+
+			# The status is written once the story is over
+			if status is not None:
+				try: os.write(status, bytes([code]))
+				except (IOError, OSError): pass
+				finally: os.close(status)
+
+# Reads the request, up to its newline, and the descriptors that may come with
+# its first bytes. Returns the request, the stream of the standard error and the
+# descriptor of the status pipe, if any
+def _receive (connection):
+
+	fds = []
+	if hasattr(socket, 'recv_fds'):
+		data, fds, flags, address = socket.recv_fds(connection, _CHUNK_SIZE, 2)
+	else: data = connection.recv(_CHUNK_SIZE)
+
+	# Any descriptor beyond those expected is not kept open
+	for e in fds[2:]: os.close(e)
+
+	while data and not data.endswith(b'\n'):
+		chunk = connection.recv(_CHUNK_SIZE)
+		if not chunk: break
+		data += chunk
+
+	errors = io.open(fds[0], 'w', encoding='utf-8') if fds else None
+	status = fds[1] if len(fds) > 1 else None
+
+	try: request = json.loads(data.decode('utf-8'))
+	except ValueError:
+		if errors: errors.close()
+		if status is not None: os.close(status)
+		raise
+
+	return request, errors, status
+
+# The client only needs to connect, so the rest of the package is loaded only
+# by the daemon. Loading the graph resets the handling of broken pipes, which
+# the daemon must ignore instead
+def serve (path):
+
+	from . import graph
+	from signal import signal, SIGPIPE, SIG_IGN
+	signal(SIGPIPE, SIG_IGN)
+
+	daemon = Daemon()
+
+	# A socket left behind by a previous daemon is replaced
+	if os.path.exists(path): os.unlink(path)
+
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	mask = os.umask(0o077)
+	try: server.bind(path)
+	finally: os.umask(mask)
+	server.listen(16)
+
+	try:
+		while True:
+			connection, address = server.accept()
+			try: daemon.handle(connection)
+			finally: connection.close()
+
+	except KeyboardInterrupt: pass
+
+	finally:
+		server.close()
+		os.unlink(path)
+
+# Sends the arguments to the daemon and copies back its answer. Returns the exit
+# status, or nothing if there is no daemon to ask, so that the story is told
+# locally
+def forward (path):
+
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try: client.connect(path)
+	except (IOError, OSError):
+		client.close()
+		return None
+
+	# The standard error goes along, for the daemon to report on it, with a
+	# pipe for the status, which the daemon alone then holds open
+	request = {'cwd': os.getcwd(), 'args': sys.argv[1:]}
+	data = json.dumps(request).encode('utf-8') + b'\n'
+	status = None
+	if hasattr(socket, 'send_fds'):
+		status, pipe = os.pipe()
+		try: sent = socket.send_fds(client, [data], [sys.stderr.fileno(), pipe])
+		finally: os.close(pipe)
+		data = data[sent:]
+	client.sendall(data)
+	client.shutdown(socket.SHUT_WR)
+
+	sys.stdout.flush()
+	stream = getattr(sys.stdout, 'buffer', sys.stdout)
+
+	while True:
+		chunk = client.recv(_CHUNK_SIZE)
+		if not chunk: break
+		stream.write(chunk)
+
+	stream.flush()
+	client.close()
+
+	# A daemon gone without a word failed
+	if status is None: return 0
+	code = os.read(status, 1)
+	os.close(status)
+	return code[0] if code else 1
@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+
+import json
+
+from binascii import unhexlify
+from struct import pack
+
+# Rows can be exported for other renderers, one record per row, instead of
+# being drawn. A record holds the line of the row in the whole layout, the
+# column and border of its commit, the commit and its parents, and the lines
+# of its message. Records are written as they come, so no export is ever held
+# in memory as a whole. Flipping the layout is up to the renderer. The option
+# parser knows the names of the formats on its own, not to load this module
+
+# One JSON object per line
+def _jsonl_record (line, column, border, commit, parents, message):
+	record = {'line': line, 'column': column, 'border': border,
+		'commit': commit, 'parents': parents,
+		'message': message.decode('utf-8').split('\n') if message is not None else []}
+	return json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+
+# After a magic header, each record is prefixed by the length of the rest of
+# it. All integers are unsigned and little-endian:
+#
+#	u32 length
+#	u32 line, u32 column, u32 border
+#	u8 size of a commit name in bytes, then the commit name
+#	u16 number of parents, then their names, of the same size
+#	u32 size of the message in bytes, then the message, lines split by \n
+_BINARY_MAGIC = b'GHL\x01'
+
+def _binary_record (line, column, border, commit, parents, message):
+
+	name = unhexlify(commit)
+	text = bytes(message or b'')
+
+	body = [pack('<IIIB', line, column, border, len(name)), name,
+		pack('<H', len(parents))]
+	body.extend([unhexlify(e) for e in parents])
+	body.extend((pack('<I', len(text)), text))
+
+	body = b''.join(body)
+	return pack('<I', len(body)) + body
+
+_ENCODERS = {'jsonl': (b'', _jsonl_record), 'binary': (_BINARY_MAGIC, _binary_record)}
+
+# Writes a record for each node of the window, as given by the layout
+# generators, starting from the first line of the window
+def export (name, history, window, skip, out):
+
+	header, encode = _ENCODERS[name]
+	out.write(header)
+
+	for line, (node, cells) in enumerate(window, skip):
+
+		# Raw messages are copied as they are, with no decoding
+		message = history.message(node)
+
+		out.write(encode(line, history.column[node], history.border[node],
+			history.name[node], history.names(history.parents(node)), message))
+
+	out.flush()
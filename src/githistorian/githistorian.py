@@ -1,33 +1,113 @@
 # -*- encoding: utf-8 -*-
 from __future__ import print_function
-from subprocess import check_output, STDOUT
 
-from .hunter.head import hunt as head_hunt
-from .hunter.history import hunt as history_hunt
+import sys
+
 from .option import parse as parse_cmd_args
-from .graph import deploy as deploy_graph
+
+# A single rev-parse finds both the Git directory and the commit HEAD points to
+def _check_repo ():
+
+	from subprocess import Popen, PIPE, DEVNULL
+
+	process = Popen('git rev-parse --git-dir HEAD'.split(), stdout=PIPE, stderr=DEVNULL)
+	output = process.communicate()[0].decode('utf-8').splitlines()
+
+	if process.returncode or len(output) != 2: return None
+	return output
+
+# Returns the Git directory and the commits the options select as targets, or
+# nothing if not in a repo
+def find_targets (opt):
+
+	from .hunter.head import start as head_start, hunt as head_hunt
+	from . import timing
+
+	# Refs are listed while the repo is checked
+	listing = head_start(opt)
+
+	with timing.phase('repo check'):
+		found = _check_repo()
+
+	if not found: return None
+	gitdir, head = found
+
+	with timing.phase('heads'):
+		targets = head_hunt(opt, head, listing)
+
+	return gitdir, targets
+
+def print_stats (opt, targets, roots, history):
+	print('Targets order   %s' % opt.order)
+	print('Targets found   %s' % targets)
+	print('Roots displayed %s' % history.names(roots))
+	lines, commits, omitted = history.stats()
+	print('Loaded %d commits, %d omitted' % (commits, omitted))
 
 def tell_the_story():
 
 	opt = parse_cmd_args()
 	if not opt: return
 
-	try: check_output('git rev-parse --git-dir'.split(), stderr=STDOUT)
-	except:
-		print('Not a repo')
-		return
+	# A running daemon, if any, tells the story in our place
+	if opt.socket:
+		from .daemon import forward
+		status = forward(opt.socket)
+		if status is not None: return status
+
+	if opt.serve:
+		from .daemon import serve
+		return serve(opt.serve)
+
+	if opt.batch:
+		from .batch import run
+		return run(opt)
+
+	# Nothing but the options is loaded before they are known to ask for a
+	# history, so that help and version come out as fast as Python starts
+	from . import timing
+
+	if opt.timings: timing.enable(memory=opt.memory)
+
+	# Targets naming no commit are reported, not traced
+	try: history = tell(opt)
+	except ValueError as err:
+		print(err, file=sys.stderr)
+		return 1
+
+	if history is None: print('Not a repo')
+
+	if opt.timings: timing.disable().report(sys.stderr)
+
+# Tells the story of the repo in the current directory, as the options ask.
+# Returns the history, or nothing if not in a repo, leaving the caller to say so
+def tell (opt):
+
+	from .hunter.history import hunt as history_hunt, is_cached
+	from .graph import deploy as deploy_graph
+	from . import timing
+
+	found = find_targets(opt)
+	if not found: return None
+	gitdir, targets = found
+
+	# A stored layout spares hunting the history it holds; messages are then
+	# loaded only as their rows are displayed, as none is stored
+	if is_cached(opt):
+		from .cache import hunt as cache_hunt
+		opt.lazy = True
+		roots, history, below, done, stale = cache_hunt(opt, targets, gitdir)
 
 	# Hunting for history
-	targets = head_hunt(opt)
-	roots, history = history_hunt(opt, targets, opt.limit)
+	else:
+		with timing.phase('parse'):
+			roots, history = history_hunt(opt, targets, opt.limit, gitdir)
+		below, done, stale = -1, None, False
 
-	if opt.verbose:
-		print('Targets order   %s' % opt.order)
-		print('Targets found   %s' % targets)
-		print('Roots displayed %s' % roots)
-		lines, commits, omitted = history.stats()
-		print('Loaded %d commits, %d omitted' % (commits, omitted))
+	if opt.verbose: print_stats(opt, targets, roots, history)
 
 	# Graph unrolling
-	deploy_graph(opt, roots, history)
+	deploy_graph(opt, roots, history, gitdir, below, done, stale)
+
+	return history
 
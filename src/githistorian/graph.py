@@ -5,78 +5,220 @@ from __future__ import print_function
 from signal import signal, SIGPIPE, SIG_DFL
 signal(SIGPIPE, SIG_DFL)
 
-from .row import unroll as row_unroll
-from .column import unroll as column_unroll
-from .layout import Layout
+from itertools import islice
+
+from .row import unroll as row_unroll, stream as row_stream
+from .component import unroll as component_unroll
+from .column import unroll as column_unroll, stream as column_stream
+from .layout import Layout, draw_transition, draw_padding
+from .output import Writer, draw_row
+from .export import export
+from .visit import VisitOrder
+from .hunter.history import load_messages, is_cached
+from . import timing
 
-class VisitOrder:
+def _bind_children (heads, db):
 
-	def __init__ (self):
-		self.content = []
+	order = VisitOrder(True)
+	order.push(heads)
+	visited = []
 
-	def push (self, arg):
-		if len(arg) == 0: return
-		for e in reversed(arg):
-			self.content.insert(0, e)
+	while order.has_more():
 
-	def is_empty (self):
-		return len(self.content) == 0
+		node = order.pop()
 
-	def has_more (self):
-		return len(self.content)
+		if db.done[node]: continue
 
-	def pop (self):
-		try: return self.content.pop(0)
-		except: return None
+		visited.append(node)
+		order.push(db.skip_if_done(db.parents(node)))
 
-def _bind_children (heads, db):
+		db.done[node] = 1
 
-	order = VisitOrder()
-	order.push(heads)
+	db.bind_children(visited)
 
-	while order.has_more():
+# Walks the given lines in batches, so that missing messages can be loaded
+# once per batch just before they are displayed
+def _walk_rows (lines, load):
 
-		name = order.pop()
-		commit = db.at(name)
+	for first in range(0, len(lines), _BATCH_SIZE):
 
-		if commit.done: continue
+		batch = lines[first:first + _BATCH_SIZE]
 
-		for i in commit.parent:
-			db.at(i).add_child(name)
+		if load:
+			with timing.phase('messages'): load(batch)
 
-		order.push(db.skip_if_done(commit.parent))
+		for e in batch: yield e
 
-		commit.done = 1
+_BATCH_SIZE = 1024
 
-def _print_graph (history, first, width, hflip, vflip):
+# A window starting past the first line must find the arrows already running
+# into it from above: on each column, at most one span crosses its top line.
+# Arrows pointing up to a parent drawn above its child are never closed, so
+# they run into the window as well
+def _enter_window (layout, history, top):
+
+	row = history.row[top]
+	for column, node in history.grid.crossing(row):
+		layout.seed(column, [e for e in history.parents(node) if history.row[e] >= row])
+
+	for node, parent in history.inverted:
+		if history.row[node] < row:
+			layout.seed(history.column[node], [parent])
+
+# Yields each node of the window of a history already laid out, from top to
+# bottom, along with the cells of its row
+def _lay_window (history, width, hflip, vflip, load, skip, rows):
 
 	t = Layout(width + 1, hflip, vflip)
-	name = first
-	bigblock = []
 
-	while name:
+	if rows: lines = history.line[skip:skip + rows]
+	else: lines = history.line[skip:]
+
+	if skip and len(lines): _enter_window(t, history, lines[0])
+
+	for node in _walk_rows(lines, load):
+		yield node, t.lay(node, history.column[node], history.parents(node))
 
-		node = history.at(name)
-		transition, padding = t.compute_layout(node)
+	timing.count('rendered rows', t.rows)
+	timing.count('rendered cells', t.cells)
 
-		block = ['\x1b[m%s\x1b[m %s' % (transition, node.message[0])]
-		for i in node.message[1:]: block.append('\x1b[m%s\x1b[m %s' % (padding, i))
+def _print_graph (history, width, hflip, vflip, load, skip, rows):
 
-		if vflip: bigblock.append('\n'.join(block))
-		else: print('\n'.join(block))
+	out = Writer()
+	bigblock = []
+
+	for node, cells in _lay_window(history, width, hflip, vflip, load, skip, rows):
+
+		block = draw_row(history.message(node), draw_transition(cells), draw_padding(cells))
 
-		name = node.bottom
+		if vflip: bigblock.append(block)
+		else: out.write(block)
 
 	if vflip:
 		bigblock.reverse()
-		print('\n'.join(bigblock))
+		for block in bigblock: out.write(block)
+
+	out.flush()
+
+# How many lines may wait for their final row before the topmost is settled
+_LOOKAHEAD = 256
+
+# Rows come out in smaller chunks while streaming, not to hold them back
+_STREAM_BUFFER_SIZE = 1 << 12
+
+# The whole history is still read and its children bound first, as the visit
+# counts them, but then rows are laid out, assigned a column and drawn one by
+# one as soon as they settle, instead of after the layout of every row. As the
+# width is not known in advance, each row is as wide as the columns used so far
+def _stream_graph (opt, roots, history):
+
+	with timing.phase('bind'):
+		_bind_children(roots, history)
+		history.clear()
+
+	if opt.lazy: load = lambda nodes: load_messages(opt, history, nodes)
+	else: load = None
+
+	with timing.phase('stream'):
+		out = Writer(_STREAM_BUFFER_SIZE)
+		window = _lay_stream(opt, roots, history, load)
+
+		if opt.format: return export(opt.format, history, window, opt.skip, out)
+
+		for node, cells in window:
+			out.write(draw_row(history.message(node), draw_transition(cells), draw_padding(cells)))
+		out.flush()
+
+# Yields each node of the window, from top to bottom, along with the cells of
+# its row, as soon as it settles; children must already be bound
+def _lay_stream (opt, roots, history, load):
+
+	columns = column_stream(roots, history)
+	t = Layout(0, False, False)
+
+	nodes = row_stream(roots, history, opt.mingle, opt.flip, _LOOKAHEAD, opt.rtl)
+	if opt.rows: nodes = islice(nodes, opt.skip + opt.rows)
+
+	batch = []
+	for index, node in enumerate(nodes):
+
+		column = columns.place(node)
+		t.widen(column + 1)
+		cells = t.lay(node, column, history.parents(node))
+
+		# Rows before the window are still laid out, to keep the tracks right
+		if index < opt.skip: continue
+
+		batch.append((node, cells))
+		if load and len(batch) < _BATCH_SIZE: continue
+
+		for e in _flush_rows(batch, load): yield e
+		batch = []
+
+	for e in _flush_rows(batch, load): yield e
+
+	timing.count('column probes', columns.probes)
+	timing.count('rendered rows', t.rows)
+	timing.count('rendered cells', t.cells)
+
+def _flush_rows (batch, load):
+
+	if load and len(batch):
+		with timing.phase('messages'): load([e[0] for e in batch])
+
+	return batch
+
+# With a stored layout, restored by the cache, only the commits it does not
+# know are placed, on top of the chain starting at below. The layout is stored
+# again only if stale, as the one stored may already be
+def deploy (opt, roots, history, gitdir, below=-1, done=None, stale=True):
+
+	cached = is_cached(opt)
+
+	# Storing or flipping the layout needs all of it before the first row
+	if opt.progressive and not (cached or opt.hflip or opt.vflip):
+		return _stream_graph(opt, roots, history)
+
+	first, width = lay_out(opt, roots, history, below, done)
+
+	# The stored layout is pickled, so its module is loaded only when used
+	if cached and stale:
+		from .cache import save as save_layout
+		with timing.phase('cache save'):
+			save_layout(gitdir, opt, history, roots, first)
+
+	render(opt, history, width)
+
+# Places the commits not yet done, as given by the mask if any, on top of the
+# chain starting at below. Returns the first node of the chain and the width
+def lay_out (opt, roots, history, below=-1, done=None):
+
+	with timing.phase('bind'):
+		history.clear(done)
+		_bind_children(roots, history)
+
+	# Unrelated histories are laid out apart, unless mingled or stacked on a
+	# stored layout
+	with timing.phase('row'):
+		history.clear(done)
+		if opt.mingle or below >= 0 or done is not None:
+			first = row_unroll(roots, history, opt.mingle, opt.flip, below, opt.rtl)
+		else: first = component_unroll(roots, history, opt.flip, opt.rtl)
+
+	with timing.phase('column'):
+		history.clear(done)
+		width = column_unroll(roots, history)
+
+	return first, width
 
-def deploy (opt, roots, history):
+# Prints the window of a history already laid out, as the options ask
+def render (opt, history, width):
 
-	_bind_children(roots, history)
-	history.clear()
-	first = row_unroll(roots, history, opt.mingle, opt.flip)
-	history.clear()
-	width = column_unroll(roots, history, opt.flip)
-	_print_graph(history, first, width, opt.hflip, opt.vflip)
+	if opt.lazy: load = lambda nodes: load_messages(opt, history, nodes)
+	else: load = None
 
+	with timing.phase('render'):
+		if opt.format:
+			window = _lay_window(history, width, False, False, load, opt.skip, opt.rows)
+			export(opt.format, history, window, opt.skip, Writer())
+		else: _print_graph(history, width, opt.hflip, opt.vflip, load, opt.skip, opt.rows)
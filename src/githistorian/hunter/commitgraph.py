@@ -0,0 +1,171 @@
+# -*- encoding: utf-8 -*-
+
+import mmap
+import os
+
+from binascii import hexlify
+from struct import unpack_from
+
+# Reader for Git's commit-graph file, or chain of files, which holds the
+# parents of each commit in fixed-width binary tables; see
+# Documentation/technical/commit-graph-format.txt in Git's source tree
+
+_SIGNATURE = b'CGPH'
+_PARENT_NONE = 0x70000000
+_EDGE_LAST = 0x80000000
+_HASH_SIZE = {1: 20, 2: 32}
+
+class Layer:
+
+	def __init__ (self, path, base):
+
+		with open(path, 'rb') as ifd:
+			self.data = mmap.mmap(ifd.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if self.data[0:4] != _SIGNATURE or self.data[4:5] != b'\x01':
+			raise ValueError('Unknown commit-graph format in %s' % path)
+
+		self.hash_size = _HASH_SIZE[ord(self.data[5:6])]
+		count = ord(self.data[6:7])
+
+		chunks = {}
+		for i in range(count + 1):
+			name = self.data[8 + 12 * i:12 + 12 * i]
+			chunks[name] = unpack_from('>Q', self.data, 12 + 12 * i)[0]
+
+		self.fanout = chunks[b'OIDF']
+		self.lookup = chunks[b'OIDL']
+		self.commit = chunks[b'CDAT']
+		self.edge = chunks.get(b'EDGE')
+
+		# Positions are global across the chain: this layer comes after all
+		# the commits of its base layers
+		self.base = base
+		self.size = unpack_from('>L', self.data, self.fanout + 4 * 255)[0]
+
+	def close (self):
+		self.data.close()
+
+	def oid (self, index):
+		first = self.lookup + self.hash_size * index
+		return self.data[first:first + self.hash_size]
+
+	def find (self, oid):
+
+		key = ord(oid[0:1])
+		low = unpack_from('>L', self.data, self.fanout + 4 * (key - 1))[0] if key else 0
+		high = unpack_from('>L', self.data, self.fanout + 4 * key)[0]
+
+		while low < high:
+			middle = (low + high) // 2
+			value = self.oid(middle)
+			if value < oid: low = middle + 1
+			elif value > oid: high = middle
+			else: return self.base + middle
+
+		return -1
+
+	def parents (self, index):
+
+		first = self.commit + (self.hash_size + 16) * index + self.hash_size
+		one, two = unpack_from('>LL', self.data, first)
+
+		if one == _PARENT_NONE: return []
+		if two == _PARENT_NONE: return [one]
+		if not two & _EDGE_LAST: return [one, two]
+
+		# Octopus merges keep all parents but the first in the edge list
+		result = [one]
+		first = self.edge + 4 * (two & ~_EDGE_LAST)
+		while 1:
+			value = unpack_from('>L', self.data, first)[0]
+			result.append(value & ~_EDGE_LAST)
+			if value & _EDGE_LAST: return result
+			first += 4
+
+class CommitGraph:
+
+	def __init__ (self, layers):
+		self.layers = layers
+
+	def close (self):
+		for layer in self.layers: layer.close()
+
+	def layer (self, position):
+		for layer in reversed(self.layers):
+			if position >= layer.base: return layer
+
+	def find (self, name):
+		oid = bytearray.fromhex(name)
+		for layer in self.layers:
+			position = layer.find(bytes(oid))
+			if position >= 0: return position
+		return -1
+
+	def name (self, position):
+		layer = self.layer(position)
+		return hexlify(layer.oid(position - layer.base)).decode('ascii')
+
+	def parents (self, position):
+		layer = self.layer(position)
+		return layer.parents(position - layer.base)
+
+def _get_objects_dir (gitdir):
+
+	if 'GIT_OBJECT_DIRECTORY' in os.environ:
+		return os.environ['GIT_OBJECT_DIRECTORY']
+
+	# Linked worktrees share the objects of the main repository
+	commondir = os.path.join(gitdir, 'commondir')
+	if os.path.exists(commondir):
+		with open(commondir, 'r') as ifd:
+			gitdir = os.path.join(gitdir, ifd.read().strip())
+
+	return os.path.join(gitdir, 'objects')
+
+# Git does not trust the commit-graph when the parents it recorded may be
+# overridden, as with shallow clones, grafts or replace refs
+def _is_overridden (gitdir):
+
+	if os.path.exists(os.path.join(gitdir, 'shallow')): return True
+	if os.path.exists(os.path.join(gitdir, 'info', 'grafts')): return True
+	if os.path.isdir(os.path.join(gitdir, 'refs', 'replace')): return True
+
+	packed = os.path.join(gitdir, 'packed-refs')
+	if os.path.exists(packed):
+		with open(packed, 'rb') as ifd:
+			if b' refs/replace/' in ifd.read(): return True
+
+	return False
+
+# Opens the single commit-graph file or, failing that, the chain of split
+# files. Returns None if there is no usable commit-graph
+def load (gitdir):
+
+	if _is_overridden(gitdir): return None
+
+	info = os.path.join(_get_objects_dir(gitdir), 'info')
+
+	single = os.path.join(info, 'commit-graph')
+	if os.path.exists(single):
+		try: return CommitGraph([Layer(single, 0)])
+		except (IOError, OSError, ValueError, KeyError): return None
+
+	chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+	if not os.path.exists(chain): return None
+
+	layers = []
+	base = 0
+	try:
+		with open(chain, 'r') as ifd:
+			for line in ifd:
+				name = line.strip()
+				if len(name) == 0: continue
+				path = os.path.join(info, 'commit-graphs', 'graph-%s.graph' % name)
+				layers.append(Layer(path, base))
+				base += layers[-1].size
+	except (IOError, OSError, ValueError, KeyError):
+		for layer in layers: layer.close()
+		return None
+
+	return CommitGraph(layers)
@@ -1,63 +1,116 @@
 # encoding: utf-8
 
 from __future__ import print_function
-from subprocess import check_output
-import re
+from subprocess import Popen, PIPE, DEVNULL, CalledProcessError
+from bisect import bisect_right
+from itertools import accumulate
 
-def _exact_match (one, two):
-	return one == two
+# Refs are indexed once by name. Exact matches are looked up in a table, while
+# the names containing an argument are found by scanning a single string that
+# holds all the names, one per line, so that each lookup costs one native
+# search per matching ref instead of one comparison per ref
+class RefIndex:
 
-def _prefix_match (one, two):
-	return one in two
+	def __init__ (self, heads):
+
+		self.heads = heads
+		self.commits = [e[0] for e in heads]
+		self.exact = None
+
+		names = [e[1] for e in heads]
+		self.text = ''.join([e + '\n' for e in names])
+		self.offsets = list(accumulate([0] + [len(e) + 1 for e in names]))
+
+	def exact_match (self, name):
+
+		# The table is built on the first exact lookup
+		if self.exact is None:
+			self.exact = {}
+			for commit, ref in self.heads:
+				self.exact.setdefault(ref, []).append(commit)
+
+		return self.exact.get(name, [])
+
+	# Refs are returned in their own order, each once
+	def prefix_match (self, name):
+
+		result = []
+		position = 0
+
+		while position < len(self.text):
+
+			found = self.text.find(name, position)
+			if found < 0: break
+
+			index = bisect_right(self.offsets, found) - 1
+			end = self.offsets[index + 1] - 1
+
+			# A match running across the separator does not count
+			if found + len(name) > end:
+				position = found + 1
+				continue
+
+			result.append(self.commits[index])
+			position = end + 1
+
+		return result
 
 def _get_all_heads (heads):
 	seen = set()
 	f = seen.add
 	return [e[0] for e in heads if not (e[0] in seen or f(e[0]))]
 
-def _get_selected_heads (f, heads, order):
+# The right end of a range matching no ref is asked to Git as a revision, as
+# are the left ends, which Git would otherwise reject only as it walks
+def _resolve (name):
+
+	cmdlist = ['git', 'rev-parse', '--verify', '--quiet', name + '^{commit}']
+	process = Popen(cmdlist, stdout=PIPE, stderr=DEVNULL)
+	output = process.communicate()[0].decode('utf-8').strip()
+
+	if process.returncode: raise ValueError('No match for (%s)' % name)
+	return output
+
+def _get_selected_heads (f, order, ends):
 
 	seen = set()
 	g = seen.add
 	result = []
 
 	for name in order:
-		for e in heads:
-			if f(name, e[1]):
-				# heads.remove(e)
-				result.append(e[0])
+		found = f(name)
+		if not found and name in ends: found = [_resolve(name)]
+		result.extend(found)
 
 	return [e for e in result if not (e in seen or g(e))]
 
-def _load_HEAD ():
+# All the refs are listed by a single for-each-ref, which is started as soon as
+# the options are known, so that it runs while the repo is checked; its output
+# is read only by hunt. Unless remotes are asked for, only local branches and
+# tags are listed; with remotes, every ref is, tags included even without
+# asking for them. The show-ref this replaces listed only tags when asked for
+# both, leaving out branches and remotes alike
+def start (opt):
 
-	cmdlist = 'git show-ref --heads --head'.split()
+	if not (len(opt.order) or opt.heads): return None
 
-	output = check_output(cmdlist).decode('utf-8')
+	cmdlist = ['git', 'for-each-ref', '--format=%(objectname) %(refname)']
+	if not opt.remotes:
+		cmdlist.append('refs/heads')
+		if opt.tags: cmdlist.append('refs/tags')
 
-	exp = re.compile(r'^(.*) HEAD$')
+	return cmdlist, Popen(cmdlist, stdout=PIPE, stderr=DEVNULL)
 
-	for line in output.split('\n'):
+def _load_heads (listing):
 
-		if len(line) == 0: continue
-
-		token = exp.match(line)
-		if not token: continue
-
-		return (token.group(1), 'HEAD')
-
-def _load_heads (opt):
+	cmdlist, process = listing
 
 	collected = []
-	exp = re.compile(r'^(.*) refs\/.*\/(.*)$')
 
-	# Looking for heads, i.e. active branches
-	cmdlist = ['git', 'show-ref']
-	if not opt.remotes: cmdlist.append('--heads')
-	if opt.tags: cmdlist.append('--tags')
-
-	# Invoke Git
-	git_output = check_output(cmdlist).decode('utf-8')
+	# Waiting for Git
+	git_output = process.communicate()[0].decode('utf-8')
+	if process.returncode:
+		raise CalledProcessError(process.returncode, cmdlist)
 
 	# Parsing Git response
 	for line in git_output.split('\n'):
@@ -65,24 +118,32 @@ def _load_heads (opt):
 		# Skipping empty lines (the last one should be empty)
 		if len(line) == 0: continue
 
-		# Matching name and name
-		name_n_ref = exp.match(line)
+		# Splitting commit and ref, whose last component is the name
+		commit, sep, ref = line.partition(' refs/')
+		name = ref.rpartition('/')
 
 		# Broken ref: display message and skip line
-		if not name_n_ref:
+		if not sep or not name[1]:
 			print('No match for (%s)' % line)
 			continue
 
 		# Save result in order and by name
-		collected.append((name_n_ref.group(1), name_n_ref.group(2)))
+		collected.append((commit, name[2]))
 
 	return collected
 
-def hunt (opt):
+# The commit HEAD points to is known since the repo was checked
+def hunt (opt, head, listing):
+
+	if listing:
+		collected = _load_heads(listing) + [(head, 'HEAD')]
+		if opt.heads: targets = _get_all_heads(collected)
+		else:
+			index = RefIndex(collected)
+			targets = _get_selected_heads(index.exact_match if opt.match else index.prefix_match, opt.order, opt.ends)
+	else: targets = [head]
 
-	if len(opt.order) or opt.heads:
-		collected = _load_heads(opt) + [_load_HEAD()]
-		if opt.heads: return _get_all_heads(collected)
-		return _get_selected_heads(_exact_match if opt.match else _prefix_match, collected, opt.order)
-	return _load_HEAD()
+	for name in opt.exclude:
+		if name != 'HEAD': _resolve(name)
 
+	return targets
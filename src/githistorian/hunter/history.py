@@ -1,55 +1,291 @@
 # -*- encoding: utf-8 -*-
 
-from subprocess import check_output
+from subprocess import Popen, PIPE, CalledProcessError
 
-from ..node import Node, NodeDB
+from ..node import NodeDB
+from . import commitgraph
+from .. import timing
 
 # Apply user specified pretty format or the default with no preference is
-# supplied
-def _select_pretty (value):
-	if value: return r'--pretty=%H %P#' + value
-	return r'--pretty=%H %P#%C(yellow)%h%C(auto)%d%Creset %s %C(bold red)%ar%Cblue %an'
+# supplied; the prefix selects what comes before the message
+def _select_pretty (value, prefix=r'%H %P'):
+	if value: return r'--pretty=%s#' % prefix + value
+	return r'--pretty=%s#%%C(yellow)%%h%%C(auto)%%d%%Creset %%s %%C(bold red)%%ar%%Cblue %%an' % prefix
+
+# Ranges and filters are evaluated by Git, which walks only the history they
+# select. Parents outside of it are cut off as they are with a limit. Commits
+# not touching the paths are skipped, with parents rewritten past them, and so
+# are those of other authors, though only by _hunt_authored
+def filters (opt, author=True):
+
+	result = []
+	if opt.since: result.append('--since=%s' % opt.since)
+	if opt.until: result.append('--until=%s' % opt.until)
+	if opt.author and author: result.append('--author=%s' % opt.author)
+	if opt.first_parent: result.append('--first-parent')
+	if opt.paths: result.append('--parents')
+
+	return result
+
+def is_filtered (opt):
+	return bool(opt.exclude or opt.paths or filters(opt))
+
+# A limited or filtered history is never stored, as it has fake nodes and
+# parents cut off
+def is_cached (opt):
+	return bool(opt.cache and not (opt.limit or is_filtered(opt)))
+
+# Size of the chunks read from the git-log pipe
+_CHUNK_SIZE = 1 << 16
 
 # Invokes git-log with optional size limit to collect commits, their relation
-# with others and the custom messages
-def _get_history_dump (opt, heads, limit):
+# with others and the custom messages. Lines are yielded as soon as they come
+# out of the pipe, so that parsing overlaps with Git walking the history and
+# the whole dump is never held in memory. Git starts right away, even if the
+# lines are read only later
+def _get_history_dump (opt, heads, limit, pretty, author=True):
 
-	cmdlist = ['git', 'log', _select_pretty(opt.pretty)]
+	cmdlist = ['git', 'log', pretty] + filters(opt, author)
 	if limit: cmdlist.append('-n%d' % limit)
 	cmdlist.extend(heads)
+	cmdlist.extend(['^' + e for e in opt.exclude])
+	if opt.paths: cmdlist.extend(['--'] + opt.paths)
 
-	return check_output(cmdlist).decode('utf-8')
+	process = Popen(cmdlist, stdout=PIPE, bufsize=_CHUNK_SIZE)
+	return _read_history_dump(cmdlist, process)
 
-def hunt (opt, heads, limit):
+def _read_history_dump (cmdlist, process):
 
-	history = NodeDB()
-	current = None
+	for line in process.stdout:
+		yield line.rstrip(b'\n')
+
+	process.stdout.close()
+	if process.wait():
+		raise CalledProcessError(process.returncode, cmdlist)
 
-	for line in _get_history_dump(opt, heads, limit).split('\n'):
+# Splits the dump into records, one per commit, yielding the names before the
+# sharp character and the slice of the text where the lines of the message were
+# appended, split by newlines. No line outlives its record
+def _get_records (lines, text):
+
+	names = None
+
+	for line in lines:
 
 		# Skipping empty lines (the last one should be empty)
 		if len(line) == 0: continue
 
-		if '#' in line:
+		if b'#' in line:
 
-			# Store node in map if any, then create new one
-			if current: history.add_node(current)
-			current = Node()
+			# Yield the record if any, then start a new one
+			if names is not None: yield names, first, len(text) - first
 
 			# Split line over the sharp character
-			token = line.split('#', 1)
-
-			# Store name, parents, message
-			names = token[0].split()
-			current.name = names[0]
-			for i in names[1:]: current.parent.append(i)
-			current.message = [token[1]]
+			head, message = line.split(b'#', 1)
+			names = head.decode('utf-8').split()
+			first = len(text)
+			text += message
 
 		else:
-			current.message.append(line)
+			text += b'\n'
+			text += line
+
+	# Yield the last record
+	if names is not None: yield names, first, len(text) - first
+
+# Loads the relations between commits from the commit-graph, which must know
+# all the heads, while git-log prints only the messages, unless these are to be
+# loaded later
+def _hunt_commit_graph (opt, heads, gitdir):
+
+	graph = commitgraph.load(gitdir)
+	if not graph: return None
+
+	try:
+		order = []
+		for name in heads:
+			position = graph.find(name)
+			if position < 0: return None
+			order.append(position)
+
+		# Git walks the history while the commit-graph is read
+		if not opt.lazy:
+			pretty = _select_pretty(opt.pretty, r'%H')
+			dump = _get_history_dump(opt, heads, False, pretty)
+
+		history = NodeDB()
+		names = {}
+		seen = set(order)
+
+		while len(order):
+
+			position = order.pop()
+			parents = graph.parents(position)
+
+			for i in parents:
+				if i not in seen:
+					seen.add(i)
+					order.append(i)
+
+			for i in [position] + parents:
+				if i not in names: names[i] = graph.name(i)
+
+			history.add_node(names[position], [names[i] for i in parents])
+
+	finally: graph.close()
+
+	if not opt.lazy: _set_messages(history, timing.timed('log dump', dump))
+
+	return history
+
+# Messages of commits not in the history are dropped from the text right away
+def _set_messages (history, lines):
+	for names, first, size in _get_records(lines, history.text):
+		node = history.name.find(names[0])
+		if node >= 0: history.set_message(node, first, size)
+		else: del history.text[first:]
+
+# Size of the batches of messages asked to Git at once
+_BATCH_SIZE = 1024
+
+# Loads the messages of the given nodes, if still missing, in batches, by
+# naming the commits to git-log on its standard input
+def load_messages (opt, history, nodes):
+
+	cmdlist = ['git', 'log', '--no-walk=unsorted', '--stdin', _select_pretty(opt.pretty, r'%H')]
+	missing = [history.name[e] for e in nodes if not history.has_message(e)]
+
+	for first in range(0, len(missing), _BATCH_SIZE):
+
+		batch = '\n'.join(missing[first:first + _BATCH_SIZE]) + '\n'
+
+		process = Popen(cmdlist, stdin=PIPE, stdout=PIPE)
+		output = process.communicate(batch.encode('utf-8'))[0]
+		if process.returncode:
+			raise CalledProcessError(process.returncode, cmdlist)
 
-	# Store the last node
-	history.add_node(current)
+		_set_messages(history, output.split(b'\n'))
+
+# Loads into a history restored from a previous run only the commits the heads
+# reach past its tips, which Git alone walks, with no message. Returns the new
+# nodes, or nothing if any of them names a parent not in the history
+def hunt_new (opt, heads, tips, history):
+
+	db = history
+	lines = _get_history_dump(opt, heads + ['^' + e for e in tips], False, r'--pretty=%H %P#')
+
+	# The output is read to the end, for Git to exit, and only then checked:
+	# commits already in the history, or parents never listed, cannot be
+	# stacked on top of it
+	known = len(db.name)
+	nodes = []
+	for names, first, size in _get_records(timing.timed('log dump', lines), db.text):
+		nodes.append(db.add_node(names[0], names[1:]))
+
+	for node in nodes:
+		if node < known: return None
+		for parent in db.parents(node):
+			if not db.has(parent): return None
+
+	return nodes
+
+# Names each of the commits by itself if selected, or else by the nearest
+# selected commits it reaches through the topology. Commits out of the topology
+# are cut off, and named by themselves too. Commits left out are resolved once,
+# parents first, and remembered
+def _rewrite (topology, selected, memo, names):
+
+	result = []
+	for name in names:
+
+		if name in selected or name not in topology:
+			result.append(name)
+			continue
+
+		stack = [name]
+		while len(stack):
+
+			e = stack[-1]
+			if e in memo:
+				stack.pop()
+				continue
+
+			pending = [i for i in topology[e] if not (i in selected or i in memo or i not in topology)]
+			if len(pending):
+				stack.extend(pending)
+				continue
+
+			stack.pop()
+			nearest = []
+			for i in topology[e]:
+				nearest.extend(memo.get(i, (i,)))
+			memo[e] = _get_unique(nearest)
+
+		result.extend(memo[name])
+
+	return _get_unique(result)
+
+def _get_unique (names):
+	seen = set()
+	f = seen.add
+	return [e for e in names if not (e in seen or f(e))]
+
+# Git does not rewrite the parents of commits selected by author, so each is
+# linked here to its nearest selected ancestors, over the topology of the range
+# as walked by Git with the other filters, at the same time. The heads are
+# rewritten likewise. The limit counts selected commits only. Returns the
+# history and the heads
+def _hunt_authored (opt, heads, limit, last):
+
+	if opt.lazy: pretty = r'--pretty=%H#'
+	else: pretty = _select_pretty(opt.pretty, r'%H')
+
+	dump = _get_history_dump(opt, heads, False, pretty)
+	lines = _get_history_dump(opt, heads, False, r'--pretty=%H %P#', False)
+
+	topology = {}
+	for names, first, size in _get_records(timing.timed('log dump', lines), bytearray()):
+		topology[names[0]] = names[1:last]
+
+	history = NodeDB()
+	records = []
+	for names, first, size in _get_records(timing.timed('log dump', dump), history.text):
+		if limit and len(records) >= limit: del history.text[first:]
+		records.append((names[0], first, size))
+
+	selected = set([e[0] for e in records])
+	memo = {}
+
+	for name, first, size in records[:limit or None]:
+		parents = _rewrite(topology, selected, memo, topology.get(name, ()))
+		if opt.lazy: history.add_node(name, parents)
+		else: history.add_node(name, parents, first, size)
+
+	return history, _rewrite(topology, selected, memo, heads)
+
+def hunt (opt, heads, limit, gitdir):
+
+	# Without a limit or filters, Git's own commit-graph can provide the
+	# relations
+	history = None
+	if not (limit or is_filtered(opt)): history = _hunt_commit_graph(opt, heads, gitdir)
+
+	# With lazy loading, only relations are read now and each message is left
+	# empty, until its row is about to be displayed
+	if history is None:
+		if opt.lazy: pretty = r'--pretty=%H %P#'
+		else: pretty = _select_pretty(opt.pretty, r'%H %P')
+
+		# Git still prints every parent of a merge along its first parent
+		last = 2 if opt.first_parent else None
+
+		if opt.author: history, heads = _hunt_authored(opt, heads, limit, last)
+		else:
+			history = NodeDB()
+			lines = timing.timed('log dump', _get_history_dump(opt, heads, limit, pretty))
+			for names, first, size in _get_records(lines, history.text):
+				if opt.lazy: history.add_node(names[0], names[1:last])
+				else: history.add_node(names[0], names[1:last], first, size)
 
 	# Cleaning database from missing refs
 	history.drop_missing_refs()
@@ -57,5 +293,11 @@ def hunt (opt, heads, limit):
 	# Cleaning root list from missing heads
 	roots = history.drop_missing_heads(heads)
 
+	# Paths and dates may skip the heads themselves, whose history then starts
+	# at the commits left with no children, shown after the heads found
+	if is_filtered(opt) and len(roots) < len(heads):
+		found = set(roots)
+		roots.extend([e for e in history.find_tips() if e not in found])
+
 	return roots, history
 
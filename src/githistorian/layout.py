@@ -1,11 +1,31 @@
 # -*- encoding: utf-8 -*-
 
-class Column:
+from collections import namedtuple
 
-	def __init__ (self, color, transition, padding):
-		self.color = color
-		self.transition = transition
-		self.padding = padding
+# Each cell of a row holds the glyph drawn beside the commit, the glyph drawn
+# beside the other lines of its message, and their ANSI color code
+Column = namedtuple('Column', 'color transition padding')
+
+# Every colored glyph is encoded once, the first time it is drawn
+_GLYPHS = {}
+
+def _encode (color, glyph):
+
+	try: return _GLYPHS[color, glyph]
+	except KeyError: pass
+
+	# Bullets are always drawn with no color
+	if glyph == '•': value = '\x1b[m•'.encode('utf-8')
+	else: value = ('\x1b[%dm%s' % (color, glyph)).encode('utf-8')
+
+	_GLYPHS[color, glyph] = value
+	return value
+
+def draw_padding (cells):
+	return b''.join([_encode(i.color, i.padding) for i in cells])
+
+def draw_transition (cells):
+	return b''.join([_encode(i.color, i.transition) for i in cells])
 
 class Layout:
 
@@ -15,7 +35,15 @@ class Layout:
 		self.hflip = hflip
 
 		self.layout = []
-		self.track = {i:set() for i in range(-1, size)}
+
+		# Each track holds the names still waiting for an arrow on that
+		# column; the reverse index maps each name to the tracks holding it
+		self.track = [set() for i in range(size)]
+		self.held = {}
+
+		# Rows drawn so far, and columns walked to draw them
+		self.rows = 0
+		self.cells = 0
 
 		self.ltee = '├' if self.hflip else '┤' # \u 251c or 2524
 		self.rtee = '┤' if self.hflip else '├' # \u 2524 or 251c
@@ -30,32 +58,45 @@ class Layout:
 		self.rarrow = '←' if self.hflip else '→' # \u 2192 or 2190
 		self.larrow = '→' if self.hflip else '←' # \u 2190 or 2192
 
+	# Marks the names as waiting for an arrow on the column, as if some node
+	# above had already been drawn there
+	def seed (self, column, names):
+		self.track[column].update(names)
+		for name in names:
+			self.held.setdefault(name, set()).add(column)
+
+	# Adds empty tracks on the right, up to the given size
+	def widen (self, size):
+		while self.size < size:
+			self.track.append(set())
+			self.size += 1
+
 	def put_char(self, name, transition, padding):
 		column = Column(31 + name % 6, transition, padding)
 		self.layout.append(column)
 
 	def compute_even_column(self, index, target):
 
-		if index == target.column:
+		if index == self.column:
 
-			if len(target.parent): padding = '│' # \u2502
+			if len(self.parents): padding = '│' # \u2502
 			else: padding = ' '
 
 			overlap = []
 			for e in self.track[index]:
-				if e == target.name: continue
-				if e in target.parent: continue
+				if e == target: continue
+				if e in self.parents: continue
 				overlap.append(e)
 
 			if len(overlap): transition = '╳' # \u2573
 			else: transition = '•' # \u2022
 
-			self.put_char(target.column, transition, padding)
+			self.put_char(self.column, transition, padding)
 			return
 
-		if index > target.column:
+		if index > self.column:
 
-			if target.name in self.track[index]:
+			if index in self.holding:
 				if len(self.track[index]) > 1:
 					self.put_char(index, self.ltee, '│') # \u2502
 				else:
@@ -66,14 +107,13 @@ class Layout:
 				self.put_char(index, '│', '│')
 				return
 
-			for jndex in range(index, self.size):
-				if target.name in self.track[jndex]:
-					self.put_char(jndex, self.rarrow, ' ')
-					return
+			if self.right >= 0:
+				self.put_char(self.right, self.rarrow, ' ')
+				return
 
 		else:
 
-			if target.name in self.track[index]:
+			if index in self.holding:
 				if len(self.track[index]) > 1:
 					self.put_char(index, self.rtee, '│') # \u2502
 				else:
@@ -84,10 +124,9 @@ class Layout:
 				self.put_char(index, '│', '│')
 				return
 
-			for jndex in reversed(range(0, index)):
-				if target.name in self.track[jndex]:
-					self.put_char(jndex, self.larrow, ' ') # \u2500
-					return
+			if self.left >= 0:
+				self.put_char(self.left, self.larrow, ' ') # \u2500
+				return
 
 		if len(self.track[index]):
 			self.put_char(index, '│', '│') # \u2502
@@ -98,61 +137,65 @@ class Layout:
 
 	def compute_odd_column(self, index, target):
 
-		if index > target.column:
+		if index > self.column:
 
-			if target.name in self.track[index]:
-				self.put_char(index, self.rarrow, ' ')
+			if self.right >= 0:
+				self.put_char(self.right, self.rarrow, ' ')
 				return
 
-			for jndex in range(index, self.size):
-				if target.name in self.track[jndex]:
-					self.put_char(jndex, self.rarrow, ' ')
-					return
-
 		else:
 
-			if target.name in self.track[index - 1]:
-				self.put_char(index - 1, self.larrow, ' ')
+			if self.left >= 0:
+				self.put_char(self.left, self.larrow, ' ')
 				return
 
-			for jndex in reversed(range(0, index - 1)):
-				if target.name in self.track[jndex]:
-					self.put_char(jndex, self.larrow, ' ')
-					return
-
 		self.put_char(index, ' ', ' ')
 
-	def compute_layout (self, target):
+	# For each column, only the nearest tracks holding the target, on its left
+	# and on its right, are relevant; these are found by walking the sorted
+	# list of tracks holding the target along with the columns
+	def seek (self, index):
+
+		while self.cursor < len(self.sorted) and self.sorted[self.cursor] < index:
+			self.cursor += 1
+
+		if self.cursor: self.left = self.sorted[self.cursor - 1]
+		else: self.left = -1
+
+		if self.cursor < len(self.sorted): self.right = self.sorted[self.cursor]
+		else: self.right = -1
+
+	# Computes the cells of the row, without drawing them; each row gets a new
+	# list, which can be kept
+	def lay (self, target, column, parents):
 
 		self.layout = []
+		self.column = column
+		self.parents = parents
 
-		if self.size: self.compute_even_column(0, target)
+		self.rows += 1
+		self.cells += self.size
+
+		self.holding = self.held.pop(target, ())
+		self.sorted = sorted(self.holding)
+		self.cursor = 0
+
+		if self.size:
+			self.seek(0)
+			self.compute_even_column(0, target)
 
 		for i in range(1, self.size):
+			self.seek(i)
 			self.compute_odd_column(i, target)
 			self.compute_even_column(i, target)
 
-		for track in self.track.values():
-			track.discard(target.name)
+		for index in self.holding:
+			self.track[index].discard(target)
 
-		for name in target.parent:
-			self.track[target.column].add(name)
+		for name in parents:
+			self.track[column].add(name)
+			self.held.setdefault(name, set()).add(column)
 
 		if self.hflip: self.layout.reverse()
-		return self.draw_transition(), self.draw_padding()
-
-	def draw_padding (self):
-
-		padding = ''
-		for i in self.layout:
-			padding += '\x1b[%dm%s' % (i.color, i.padding)
-		return padding
-
-	def draw_transition (self):
-
-		padding = ''
-		for i in self.layout:
-			if i.transition == '•': padding += '\x1b[m•'
-			else: padding += '\x1b[%dm%s' % (i.color, i.transition)
-		return padding
+		return self.layout
 
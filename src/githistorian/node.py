@@ -1,145 +1,326 @@
 # -*- encoding: utf-8 -*-
 
-class Node:
+from array import array
+
+# Names of commits, as raw hashes laid end to end in one buffer, and indexed by
+# an open-addressing table of node ids plus one, zero standing for a free slot.
+# Hashes are random enough for their last bytes to be the key. The table is
+# kept at most half full
+class Names:
 
 	def __init__ (self):
+		self.store = bytearray()
+		self.width = 0
+		self.size = 0
+		self.slots = array('i', [0]) * 16
+
+	def __len__ (self):
+		return self.size
+
+	def __getitem__ (self, node):
+		first = node * self.width
+		return self.store[first:first + self.width].hex()
+
+	# Slot holding the hash, or the free one it would take
+	def probe (self, oid, slots):
+
+		store = self.store
+		width = self.width
+		mask = len(slots) - 1
+		slot = int.from_bytes(oid[-4:], 'big') & mask
+
+		while True:
+			node = slots[slot]
+			if not node: return slot
+			first = (node - 1) * width
+			if store[first:first + width] == oid: return slot
+			slot = (slot + 1) & mask
 
-		self.name = None
-		self.parent = []
-		self.child = []
+	# The node named, or -1 if none
+	def find (self, name):
 
-		self.message = None
-		self.done = 0
+		try: oid = bytes.fromhex(name)
+		except ValueError: return -1
+		if len(oid) != self.width: return -1
 
-		self.column = -1
-		self.border = -1
-		self.row = -1
+		return self.slots[self.probe(oid, self.slots)] - 1
 
-		self.top = None    # Previous commit by line
-		self.bottom = None # Next commit by line
-		self.left = None   # Previous commit by column
-		self.right = None  # Next commit by line
+	# The probe is repeated inline, as every name parsed goes through here
+	def intern (self, name):
 
-	def add_child (self, name):
-		if name not in self.child:
-			self.child.append(name)
+		oid = bytes.fromhex(name)
+		if not self.width: self.width = len(oid)
 
-	def has_column (self):
-		return self.column >= 0
+		store = self.store
+		width = self.width
+		slots = self.slots
+		mask = len(slots) - 1
+		slot = int.from_bytes(oid[-4:], 'big') & mask
 
-	def set_column (self, value):
-		self.column = value
-		self.set_border(value)
+		node = slots[slot]
+		while node:
+			first = (node - 1) * width
+			if store[first:first + width] == oid: return node - 1
+			slot = (slot + 1) & mask
+			node = slots[slot]
 
-	def set_border (self, value):
-		self.border = max(self.border, value)
+		node = self.size
+		self.store += oid
+		self.size += 1
+		self.slots[slot] = node + 1
 
-	def get_indent (self):
-		return ' ' * 3 * self.column
+		if 2 * self.size > len(self.slots): self.grow()
+		return node
 
-	def to_oneline(self):
-		data = (self.column, self.row, self.get_indent(), self.name[:7])
-		return '(%2d, %2d)%s • \x1b[33m%s\x1b[m' % data
+	def grow (self):
 
-	def to_string(self):
-		indent = ' ' * 2 * self.column
-		str = "%s  Name {%s}" % (indent, self.name)
-		for i in self.parent: str += "\n%sParent {%s}" % (indent, i)
-		for i in self.child:  str += "\n%s Child {%s}" % (indent, i)
-		return str
+		slots = array('i', [0]) * (2 * len(self.slots))
+		width = self.width
 
+		for node in range(self.size):
+			oid = self.store[node * width:node * width + width]
+			slots[self.probe(oid, slots)] = node + 1
+
+		self.slots = slots
+
+# Commits are interned to dense integer ids as soon as they are named, either
+# by their own record or as the parent of another one. Each attribute is a flat
+# column indexed by id, with -1 standing for "none"
 class NodeDB:
 
 	def __init__ (self):
-		self.store = {}
+
+		self.name = Names()
+
+		# Messages are slices of one buffer of raw text, lines split by
+		# newlines, decoded only when asked to. Commits with a record of their
+		# own are known, even if their message is still to be loaded
+		self.text = bytearray()
+		self.known = bytearray()
+		self.message_first = array('i')
+		self.message_size = array('i')
+
+		# Adjacency lists are slices of one flat store, CSR-style
+		self.parent_first = array('i')
+		self.parent_count = array('i')
+		self.parent_store = array('i')
+
+		self.child_first = array('i')
+		self.child_count = array('i')
+		self.child_store = array('i')
+
+		self.done = bytearray()
+
+		self.column = array('i')
+		self.border = array('i')
+		self.row = array('i')
+
+		self.top = array('i')    # Previous commit by line
+		self.bottom = array('i') # Next commit by line
+
+		self.line = array('i')   # Commits in line order
+		self.grid = None         # Spans reserved on each column
+		self.lowest = None       # Row of the lowest parent of each commit
+		self.inverted = []       # Edges whose parent is above the child
+
+		self.size = 0
 		self.fake = 0
 
 	def stats (self):
-		size = len(self.store)
-		return size, size - self.fake, self.fake
+		return self.size, self.size - self.fake, self.fake
+
+	def intern (self, name):
+
+		node = self.name.intern(name)
+		if node < len(self.known): return node
+
+		self.known.append(0)
+		self.message_first.append(-1)
+		self.message_size.append(0)
+
+		self.parent_first.append(0)
+		self.parent_count.append(0)
+		self.child_first.append(0)
+		self.child_count.append(0)
+
+		self.done.append(0)
+
+		self.column.append(-1)
+		self.border.append(-1)
+		self.row.append(-1)
 
-	def add_node (self, node):
-		self.store[node.name] = node
+		self.top.append(-1)
+		self.bottom.append(-1)
 
-	def at (self, name):
-		return self.store[name]
+		return node
 
-	def clear (self):
-		for node in self.store.values():
-			node.done = 0
+	# The message, if any, is the slice of the text holding it
+	def add_node (self, name, parents, first=-1, size=0):
+
+		node = self.intern(name)
+
+		self.parent_first[node] = len(self.parent_store)
+		self.parent_count[node] = len(parents)
+		for i in parents: self.parent_store.append(self.intern(i))
+
+		self.known[node] = 1
+		self.set_message(node, first, size)
+		self.size += 1
+
+		return node
+
+	def has (self, node):
+		return self.known[node]
+
+	def set_message (self, node, first, size):
+		self.message_first[node] = first
+		self.message_size[node] = size
+
+	# Appends the lines to the text, as the message of the node
+	def put_message (self, node, lines):
+		first = len(self.text)
+		self.text += '\n'.join(lines).encode('utf-8')
+		self.set_message(node, first, len(self.text) - first)
+
+	# Messages past the given size of the text are forgotten, to be loaded
+	# again; those before it, as of fake nodes, are kept
+	def drop_messages (self, size):
+		for node in range(len(self.name)):
+			if self.message_first[node] >= size: self.message_first[node] = -1
+		del self.text[size:]
+
+	def has_message (self, node):
+		return self.message_first[node] >= 0
+
+	# The raw message, or nothing if not loaded yet
+	def message (self, node):
+		first = self.message_first[node]
+		if first < 0: return None
+		return self.text[first:first + self.message_size[node]]
+
+	# The lines of the message, none if not loaded yet
+	def lines (self, node):
+		first = self.message_first[node]
+		if first < 0: return []
+		return self.text[first:first + self.message_size[node]].decode('utf-8').split('\n')
+
+	def parents (self, node):
+		first = self.parent_first[node]
+		return self.parent_store[first:first + self.parent_count[node]]
+
+	def children (self, node):
+		first = self.child_first[node]
+		return self.child_store[first:first + self.child_count[node]]
+
+	def sort_parents (self, node, key, reverse):
+		first = self.parent_first[node]
+		last = first + self.parent_count[node]
+		self.parent_store[first:last] = array('i',
+			sorted(self.parent_store[first:last], key=key, reverse=reverse))
+
+	def names (self, nodes):
+		return [self.name[e] for e in nodes]
+
+	def has_column (self, node):
+		return self.column[node] >= 0
+
+	def set_column (self, node, value):
+		self.column[node] = value
+		self.set_border(node, value)
+
+	def set_border (self, node, value):
+		self.border[node] = max(self.border[node], value)
+
+	# Nodes flagged in the mask, if any, stay done
+	def clear (self, mask=None):
+		if mask is not None: self.done = bytearray(mask)
+		else: self.done = bytearray(len(self.done))
+
+	# Children are bound only for the given nodes, which are those reachable
+	# from the heads. Each parent gets its own slice in the child store, and
+	# only parents of the given nodes are touched, so that a history restored
+	# from a previous run binds only its new nodes. Bound once per database
+	def bind_children (self, nodes):
+
+		count = array('i', [0]) * len(self.name)
+		parents = []
+		for node in nodes:
+			self.child_count[node] = 0
+			for parent in set(self.parents(node)):
+				if count[parent] == 0: parents.append(parent)
+				count[parent] += 1
+
+		first = 0
+		for parent in parents:
+			self.child_first[parent] = first
+			self.child_count[parent] = 0
+			first += count[parent]
+
+		self.child_store = array('i', [0]) * first
+		for node in nodes:
+			for parent in set(self.parents(node)):
+				self.child_store[self.child_first[parent] + self.child_count[parent]] = node
+				self.child_count[parent] += 1
 
 	def drop_missing_refs (self):
 
 		fakes = []
-		for node in self.store.values():
+		for node in range(len(self.name)):
+
+			if not self.has(node): continue
 
-			size = len(node.parent)
+			size = self.parent_count[node]
 
 			if size == 0: continue
 
 			elif size == 1:
 
-				if node.parent[0] not in self.store:
-					node.parent.pop(0)
+				if not self.has(self.parent_store[self.parent_first[node]]):
+					self.parent_count[node] = 0
 
 			else:
-				for name in node.parent:
-					if name not in self.store:
-						fake = Node()
-						fake.name = name
-						fake.message = ['[…]']
-						fakes.append(fake)
+				for parent in self.parents(node):
+					if not self.has(parent):
+						fakes.append(parent)
 						self.fake += 1
 
-		for fake in fakes: self.add_node(fake)
+		for fake in fakes:
+			if self.has(fake): continue
+			self.size += 1
+			self.known[fake] = 1
+			self.put_message(fake, ['[…]'])
 
 	# Due to excessively restricting size limit, some heads may not appear at
 	# all in the database. These heads are removed from the list
 	def drop_missing_heads (self, heads):
 		available = []
 		for name in heads:
-			if name in self.store:
-				available.append(name)
+			node = self.name.find(name)
+			if node >= 0 and self.has(node):
+				available.append(node)
 		return available
 
-	def skip_if_done (self, names):
-		result = []
-		for name in names:
-			if not self.store[name].done:
-				result.append(name)
-		return result
+	# Commits with a record that are no parent of any other, in the order they
+	# were first named
+	def find_tips (self):
 
-	def split_assigned_from_missing (self, names):
-		assigned = []
-		missing = []
-		for name in names:
-			if self.store[name].has_column():
-				assigned.append(name)
-			else: missing.append(name)
-		return assigned, missing
+		parent = bytearray(len(self.name))
+		for node in range(len(self.name)):
+			if not self.has(node): continue
+			for i in self.parents(node): parent[i] = 1
 
-	def select_highest (self, names, column, default):
-		result = []
-		for name in names:
-			target = self.store[name]
-			if target.has_column() and target.column <= column: continue
-			result.append(target.row)
-		if len(result) == 0: return default
-		return min(result)
-
-	def select_bounding_box (self, names, column):
+		return [e for e in range(len(self.name)) if self.has(e) and not parent[e]]
+
+	def skip_if_done (self, nodes):
 		result = []
-		for name in names:
-			target = self.store[name]
-			if target.has_column() and target.column < column: continue
-			result.append(target.row)
+		for node in nodes:
+			if not self.done[node]:
+				result.append(node)
 		return result
 
-	def select_starting_column (self, names):
+	def select_starting_column (self, nodes):
 		selection = []
-		for name in names:
-			target = self.store[name]
-			if target.has_column():
-				selection.append(target.column)
+		for node in nodes:
+			if self.column[node] >= 0:
+				selection.append(self.column[node])
 		return min(selection)
-
@@ -15,18 +15,40 @@ class Option:
 		self.tags    = False
 		self.remotes = False
 		self.mingle  = False
+		self.rtl     = False
 		self.flip    = False
 		self.hflip   = False
 		self.vflip   = False
+		self.cache   = False
+		self.lazy    = False
+		self.progressive = False
+		self.timings = False
+		self.memory  = False
+
+		self.serve   = False
+		self.socket  = False
+
+		self.format  = False
+
+		self.batch   = False
+		self.jobs    = 0
 
 		self.order   = []
+		self.ends    = []
+		self.exclude = []
+		self.paths   = []
 
 		self.pretty  = False
 		self.limit   = False
 		self.match   = False
 
-		version_file = os.path.join(os.path.dirname(__file__), 'VERSION')
-		self.version = open(version_file, 'r').read().strip()
+		self.skip    = 0
+		self.rows    = 0
+
+		self.since   = False
+		self.until   = False
+		self.author  = False
+		self.first_parent = False
 
 	def override (self, other):
 
@@ -36,22 +58,47 @@ class Option:
 		self.tags    |= other.tags
 		self.remotes |= other.remotes
 		self.mingle  |= other.mingle
+		self.rtl     |= other.rtl
 		self.flip    |= other.flip
 		self.hflip   |= other.hflip
 		self.vflip   |= other.vflip
+		self.cache   |= other.cache
+		self.lazy    |= other.lazy
+		self.progressive |= other.progressive
+		self.timings |= other.timings
+		self.memory  |= other.memory
+
+		if other.serve: self.serve = other.serve
+		if other.socket: self.socket = other.socket
+
+		if other.format: self.format = other.format
+
+		if other.batch: self.batch = other.batch
+		if other.jobs: self.jobs = other.jobs
 
 		self.order.extend(other.order)
+		self.ends.extend(other.ends)
+		self.exclude.extend(other.exclude)
+		self.paths.extend(other.paths)
 
 		if other.pretty: self.pretty = other.pretty
 
-		self.limit   |= other.limit
+		if other.limit: self.limit = other.limit
 		self.match   |= other.match
 
+		if other.skip: self.skip = other.skip
+		if other.rows: self.rows = other.rows
+
+		if other.since: self.since = other.since
+		if other.until: self.until = other.until
+		if other.author: self.author = other.author
+		self.first_parent |= other.first_parent
+
 		return self
 
 def _print_help ():
 
-	print('Usage: %s [options] targets…' % sys.argv[0])
+	print('Usage: %s [options] targets… [-- paths…]' % sys.argv[0])
 	print()
 	print(' -a, --all, --heads : adds all heads to targets')
 	print(' -t, --tags         : adds all tags to targets')
@@ -60,18 +107,47 @@ def _print_help ():
 	print(' -n<N>, --limit<N>  : cuts history to N commits')
 	print(' -p<P>, --pretty<P> : uses P as the pretty format for messages')
 	print()
+	print(' --since<D>, --until<D> : only commits more recent or older than date D')
+	print(' --author<A>            : only commits by authors matching A')
+	print(' --first-parent         : only the first parent of each merge')
+	print(' A..B, ^A               : targets B, but none of the history of A')
+	print(' -- paths…              : only commits touching the paths')
+	print()
+	print(' --skip<N> : starts displaying after the first N rows of the layout')
+	print(' --rows<N> : displays only N rows of the layout')
+	print()
 	print(' --prefix, --prefix-match   : arguments match refnames by prefix')
 	print(' -x, --exact, --exact-match : arguments must match refnames exactly')
 	print()
 	print(' -M, --mingle                          : interlap commit from parallel branches')
+	print(' -R, --right-to-left                   : visit merged branches before the first parent')
 	print(' -F, --flip, --flip-heads              : flip heads from top to bottom')
 	print(' -H, --horizontal, --flip-horizontally : flip layout from left to right')
 	print(' -V, --vertical, --flip-vertically     : flip layout from top to bottom')
 	print()
+	print(' -c, --cache : reuse the layout stored by the previous run, placing only new commits')
+	print(' -l, --lazy  : load messages only when their rows are displayed')
+	print(' -P, --progressive : once history is read, print each row as soon as its place is settled')
+	print()
+	print(' --timings : report time, peak memory and counters of each phase on stderr')
+	print(' --trace-memory : along with timings, trace the peak memory of Python objects, slowly')
+	print()
+	print(' --serve<path>  : run as a daemon, keeping layouts in memory, on socket <path>')
+	print(' --socket<path> : ask the daemon on socket <path>, if any, to tell the story')
+	print()
+	print(' --format<name> : write one record per row as jsonl or binary, instead of drawing')
+	print()
+	print(' --batch<name>      : tell the story of each repo listed in <name>, one per line as')
+	print('                      <repo> <output> [options] [targets…], <output> - for stdout')
+	print(' -j<N>, --jobs<N>   : tell up to N stories at once, one per CPU by default')
+	print()
 	print(' -f<name>, --file<name> : load preferences from <name> instead of default .githistorian')
 
-def _print_version (o):
-	print("Git-Historian %s © 2014-2017 Ivan Simonini" % o.version)
+# The version file is read only when asked for
+def _print_version ():
+	version_file = os.path.join(os.path.dirname(__file__), 'VERSION')
+	with open(version_file, 'r') as ifd: version = ifd.read().strip()
+	print("Git-Historian %s © 2014-2017 Ivan Simonini" % version)
 
 def _parse(args, sopts, lopts):
 
@@ -100,42 +176,113 @@ def _parse(args, sopts, lopts):
 			option.limit = int(value)
 		elif key in ('-p', '--pretty'):
 			option.pretty = value
+		elif key in ('--skip', '--rows'):
+			if int(value) < 0:
+				_print_help()
+				return False, None
+			setattr(option, key[2:], int(value))
 		elif key in ('-x', '--exact', '--exact-match'):
 			option.match = True
 		elif key in ('--prefix', '--prefix-match'):
 			option.match = False
 		elif key == '--version':
-			_print_version(option)
+			_print_version()
 			return False, False
 		elif key in ('-f', '--file'):
 			filename = value
 		elif key in ('-M', '--mingle'):
 			option.mingle = True
+		elif key in ('-R', '--right-to-left'):
+			option.rtl = True
 		elif key in ('-F', '--flip', '--flip-heads'):
 			option.flip = True
 		elif key in ('-H', '--horizontal', '--flip-horizontally'):
 			option.hflip = True
 		elif key in ('-V', '--vertical', '--flip-vertically'):
 			option.vflip = True
+		elif key in ('-c', '--cache'):
+			option.cache = True
+		elif key in ('-l', '--lazy'):
+			option.lazy = True
+		elif key in ('-P', '--progressive'):
+			option.progressive = True
+		elif key == '--timings':
+			option.timings = True
+		elif key == '--trace-memory':
+			option.timings = True
+			option.memory = True
+		elif key == '--serve':
+			option.serve = value
+		elif key == '--socket':
+			option.socket = value
+		elif key == '--since':
+			option.since = value
+		elif key == '--until':
+			option.until = value
+		elif key == '--author':
+			option.author = value
+		elif key == '--first-parent':
+			option.first_parent = True
+		elif key == '--batch':
+			option.batch = value
+		elif key in ('-j', '--jobs'):
+			option.jobs = int(value)
+		elif key == '--format':
+
+			# As export.export encodes them, besides drawing
+			if value not in ('ansi', 'jsonl', 'binary'):
+				_print_help()
+				return False, None
+			option.format = value if value != 'ansi' else False
 
-	option.order = args
+	for name in args:
+
+		# A range selects its right end, with none of the history of its left
+		# end, which Git resolves on its own; either end defaults to HEAD. The
+		# right end matches refs as any target does, or else names a revision.
+		# Symmetric ranges select no single end, and are not supported
+		if '...' in name:
+			print('Symmetric range (%s) not supported' % name)
+			return False, None
+
+		elif '..' in name:
+			left, right = name.split('..', 1)
+			option.exclude.append(left or 'HEAD')
+			if right:
+				option.order.append(right)
+				option.ends.append(right)
+
+		elif name.startswith('^'): option.exclude.append(name[1:])
+		else: option.order.append(name)
 
 	return option, filename
 
-def parse ():
+def parse (args=None):
 
-	sopts = 'atrhvn:p:xMFHV'
+	sopts = 'atrhvn:p:xMRFHVclPj:'
 	lopts = ['help', 'verbose', 'version',
 			'all', 'heads', 'tags', 'remotes',
-			'limit=', 'pretty=',
+			'limit=', 'pretty=', 'skip=', 'rows=',
 			'exact', 'exact-match', 'prefix', 'prefix-match',
-			'mingle',
+			'mingle', 'right-to-left',
 			'flip', 'flip-heads',
 			'horizontal', 'flip-horizontally',
-			'vertical', 'flip-vertically']
+			'vertical', 'flip-vertically',
+			'cache', 'lazy', 'progressive', 'timings', 'trace-memory', 'serve=', 'socket=', 'format=',
+			'batch=', 'jobs=',
+			'since=', 'until=', 'author=', 'first-parent']
+
+	if args is None: args = sys.argv[1:]
+
+	# Everything after a double dash is a path
+	paths = []
+	if '--' in args:
+		index = args.index('--')
+		args, paths = args[:index], args[index + 1:]
 
-	option, filename = _parse(sys.argv[1:], sopts+'f:', lopts+['file'])
+	option, filename = _parse(args, sopts+'f:', lopts+['file'])
 	if not option: return False
+	option.paths = paths
 
 	if filename and os.path.exists(filename):
 		token = []
@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+
+import sys
+
+# Size of the chunks written to the standard output
+BUFFER_SIZE = 1 << 20
+
+# Rows are written as encoded bytes into one buffer, which is handed to the
+# standard output only once it holds a large chunk
+class Writer:
+
+	def __init__ (self, size=BUFFER_SIZE):
+
+		# Anything already printed as text must come out first
+		sys.stdout.flush()
+		self.stream = getattr(sys.stdout, 'buffer', sys.stdout)
+
+		self.buffer = bytearray()
+		self.size = size
+
+	def write (self, data):
+		self.buffer += data
+		if len(self.buffer) >= self.size: self.flush()
+
+	def flush (self):
+		self.stream.write(self.buffer)
+		self.stream.flush()
+		del self.buffer[:]
+
+_RESET = b'\x1b[m'
+
+# Each line of the raw message follows the graph, the first one beside the
+# transition row and the others beside the padding
+def draw_row (message, transition, padding):
+
+	lines = message.split(b'\n')
+	block = [_RESET, transition, _RESET, b' ', lines[0], b'\n']
+	for i in lines[1:]:
+		block.extend((_RESET, padding, _RESET, b' ', i, b'\n'))
+
+	return b''.join(block)
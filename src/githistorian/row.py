@@ -1,112 +1,247 @@
 # encoding: utf-8
 
-class VisitOrder:
+from array import array
 
-	def __init__ (self, mingle):
-		self.content = []
-		self.mingle = mingle
-
-	def has_more (self):
-		return len(self.content)
-
-	def push (self, arg):
-		if len(arg) == 0: return
-		if self.mingle: self.content.extend(reversed(arg))
-		else:
-			for e in reversed(arg): self.content.insert(0, e)
-
-	def pop (self):
-		try: return self.content.pop(0)
-		except: return None
-
-	def show (self):
-		return '    [%s]' % ', '.join([e[:7] for e in self.content])
+from .visit import VisitOrder
+from . import timing
 
+# Rows are assigned in topological order, as Kahn's algorithm does: each node
+# counts its children still to be laid, and is laid only once none is left. As
+# each edge is followed once, and each drop-down only relinks one node, the
+# whole visit takes O(commits + edges). With rtl, the parents of each merge are
+# visited from the last one, so that merged branches come right below the merge
 class Row:
 
-	def __init__ (self, heads, history):
+	def __init__ (self, heads, history, rtl=False):
 		self.heads = heads
 		self.history = history
+		self.rtl = rtl
+
+	def if_done (self, node):
 
-	def if_done (self, name, target):
+		db = self.history
 
 		# No need to drop down beyond the last element
-		if self.previous == target.name: return
+		if self.previous == node: return
+
+		# A node already given out as settled never moves again
+		if self.settled[node]: return
 
 		# Binding top and bottom nodes together
-		if target.top:
-			self.history.at(target.top).bottom = target.bottom
-		self.history.at(target.bottom).top = target.top
+		top = db.top[node]
+		bottom = db.bottom[node]
+		if top >= 0: db.bottom[top] = bottom
+		else: self.first = bottom
+		db.top[bottom] = top
 
 		# Binding previous and current nodes together
-		target.top = self.previous
-		self.history.at(self.previous).bottom = name
+		db.top[node] = self.previous
+		db.bottom[self.previous] = node
 
 		# Bumping the row number another time
+		self.drops += 1
 		self.row += 1
-		target.row = self.row
+		db.row[node] = self.row
 
 		# This node is now the last
-		target.bottom = None
+		db.bottom[node] = -1
 
 		# Recording current node as the next previous
-		self.previous = name
+		self.previous = node
 
-	def if_not_done (self, name, target):
+	def if_not_done (self, node):
+
+		db = self.history
 
 		# No node can appear before any of its children
-		children = self.history.skip_if_done(target.child)
-		if len(children): return
+		if self.remaining[node]: return
 
 		# Bind this node with the previous, if any, or…
-		if self.previous:
-			target.top = self.previous
-			self.history.at(self.previous).bottom = name
+		if self.previous >= 0:
+			db.top[node] = self.previous
+			db.bottom[self.previous] = node
 
 		# … record this node as the first in the chain
-		else: self.first = name
+		else: self.first = node
 
 		# Bumping the row number
 		self.row += 1
-		target.row = self.row
+		db.row[node] = self.row
+
+		# Each parent waits for one child less
+		parents = db.parents(node)
+		for parent in set(parents) if len(parents) > 1 else parents:
+			self.remaining[parent] -= 1
 
 		# Add parents to the order
-		self.order.push(self.history.skip_if_done(target.parent))
+		parents = db.skip_if_done(parents)
+		if self.rtl: parents.reverse()
+		self.push(parents)
 
 		# The current node is the next previous
-		self.previous = name
+		self.previous = node
+		self.pending += 1
 
 		# The current node is done
-		target.done = 1
+		db.done[node] = 1
+
+	# The new chain is laid on top of the one starting at below, which was
+	# built by a previous run; rows are shifted so that they keep growing
+	# downwards across the junction
+	def stack (self, below):
+
+		db = self.history
+
+		if self.first < 0:
+			self.first = below
+			return
+
+		shift = db.row[below] - self.row - 1
+		node = self.first
+		while node >= 0:
+			db.row[node] += shift
+			node = db.bottom[node]
+
+		db.bottom[self.previous] = below
+		db.top[below] = self.previous
+
+	# Each node counts how many times it is waiting in the order, as it drops
+	# down when popped again after being done
+	def push (self, nodes):
+		for node in nodes: self.queued[node] += 1
+		self.order.push(nodes)
+
+	def step (self):
+
+		node = self.order.pop()
+		self.queued[node] -= 1
+
+		# Even if done, a node can drop down in the chain after its
+		# last-calling child
+		if self.history.done[node]: self.if_done(node)
+		else: self.if_not_done(node)
+
+	def start (self, mingle, flip):
+
+		self.reset(mingle)
+
+		# Visit starts with all the heads not yet laid out
+		heads = list(reversed(self.heads)) if flip else self.heads
+		self.push(self.history.skip_if_done(heads))
+
+	def reset (self, mingle):
 
-	def unroll (self, mingle, flip):
+		size = len(self.history.done)
+		self.queued = array('i', [0]) * size
+		self.settled = bytearray(size)
 
-		# Visit starts with all the heads
-		self.order = VisitOrder(mingle)
-		if flip: self.heads.reverse()
-		self.order.push(self.heads)
+		self.order = VisitOrder(not mingle, reverse=True)
+		self.count_children()
 
 		# Reference to previous node, to build the chain
-		self.previous = None
+		self.previous = -1
 
 		# Starting over the first row
 		self.row = -1
 
 		# The first node
-		self.first = None
+		self.first = -1
+
+		# Nodes in the chain not yet settled
+		self.pending = 0
+
+		# Nodes dropped down after being placed
+		self.drops = 0
+
+	# Children are bound only among the nodes still to be laid out, so all of
+	# them are waited for
+	def count_children (self):
+		self.remaining = array('i', self.history.child_count)
+
+	# Yields the nodes in line order while the visit is still going on. The
+	# topmost node not yet settled keeps its line once it no longer waits in
+	# the order, as only a popped node can drop down. When more than lookahead
+	# nodes are pending, the topmost one is settled anyway and will not drop
+	# down any more, so that the first lines never wait for the whole visit
+	def stream (self, mingle, flip, lookahead):
+
+		db = self.history
+		self.start(mingle, flip)
+		last = -1
+
+		while True:
+
+			more = self.order.has_more()
+			if more: self.step()
+
+			while self.pending:
+
+				node = db.bottom[last] if last >= 0 else self.first
+				if more and self.queued[node] and self.pending <= lookahead: break
+
+				self.settled[node] = 1
+				self.pending -= 1
+				last = node
+				yield node
+
+			if not more: break
+
+		timing.count('drop-downs', self.drops)
+
+	# Without mingling, the visit is depth-first, and each head is popped only
+	# once the visits from the heads before it are over. Heads, given in order
+	# and not yet done, can then be visited one at a time. For each head, this
+	# records the last row, the last node laid and the head itself if it
+	# dropped down right away; if the head was the last node laid, it drops
+	# down only if some other visit laid anything in between, which the
+	# caller knows. Nodes are not indexed by line
+	def unroll_heads (self, heads):
+
+		db = self.history
+		self.reset(False)
+		visits = []
+
+		for head in heads:
+
+			# The head is already in place, only its row is bumped
+			if db.done[head] and self.previous == head:
+				dropped = head
+				self.drops += 1
+				self.row += 1
+				db.row[head] = self.row
+
+			else:
+				dropped = -1
+				self.push([head])
+				while self.order.has_more(): self.step()
+
+			visits.append((self.row, self.previous, dropped))
+
+		return visits
+
+	def unroll (self, mingle, flip, below):
 
-		while self.order.has_more():
+		self.start(mingle, flip)
+		while self.order.has_more(): self.step()
+		timing.count('drop-downs', self.drops)
 
-			name = self.order.pop()
-			target = self.history.at(name)
+		if below >= 0: self.stack(below)
 
-			# Even if done, a node can drop down in the chain after its
-			# last-calling child
-			if target.done: self.if_done(name, target)
-			else: self.if_not_done(name, target)
+		# Nodes are indexed by line, so that the chain can be entered anywhere;
+		# the chain below was already indexed, by whoever restored it
+		db = self.history
+		line = array('i')
+		node = self.first
+		while node >= 0 and node != below:
+			line.append(node)
+			node = db.bottom[node]
+		if below >= 0: line.extend(db.line)
+		db.line = line
 
 		return self.first
 
-def unroll (heads, history, mingle, flip):
-	return Row(heads, history).unroll(mingle, flip)
+def unroll (heads, history, mingle, flip, below=-1, rtl=False):
+	return Row(heads, history, rtl).unroll(mingle, flip, below)
 
+def stream (heads, history, mingle, flip, lookahead, rtl=False):
+	return Row(heads, history, rtl).stream(mingle, flip, lookahead)
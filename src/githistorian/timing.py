@@ -0,0 +1,159 @@
+# -*- encoding: utf-8 -*-
+
+import sys
+import time
+
+from contextlib import contextmanager
+
+# Collects wall and CPU time for each phase, the peak memory and the counters of
+# the hot paths. Time spent in a phase nested inside another is not counted in
+# the outer one, so that the phases always add up to the whole run
+class Timings:
+
+	def __init__ (self, memory=False):
+
+		self.phases = {}
+		self.order = []
+		self.counters = {}
+		self.rss = None
+		self.peak = None
+
+		# Tracing every allocation slows the whole run down several times, so
+		# that the phases are timed without it, unless asked
+		self.memory = memory
+
+		# Time taken by the nested phases of each phase still running
+		self.nested = []
+
+	# Memory is traced only while a collector asking for it is active, so
+	# tracemalloc is loaded only then
+	def start (self):
+		tracemalloc = _load_tracemalloc() if self.memory else None
+		if tracemalloc and not tracemalloc.is_tracing(): tracemalloc.start()
+
+	# The resident size is the peak of the whole process, which is all of the
+	# run, but for a daemon or a batch worker, which run many
+	def stop (self):
+
+		resource = _load_resource()
+		if resource:
+			self.rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			if sys.platform != 'darwin': self.rss *= 1024
+
+		tracemalloc = _load_tracemalloc() if self.memory else None
+		if tracemalloc and tracemalloc.is_tracing():
+			self.peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+	def add (self, name, wall, cpu):
+
+		if name not in self.phases:
+			self.phases[name] = [0.0, 0.0]
+			self.order.append(name)
+
+		self.phases[name][0] += wall
+		self.phases[name][1] += cpu
+
+	def count (self, name, value=1):
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def enter (self):
+		self.nested.append([0.0, 0.0])
+		return time.time(), time.process_time()
+
+	def leave (self, name, wall, cpu):
+
+		wall = time.time() - wall
+		cpu = time.process_time() - cpu
+
+		nested = self.nested.pop()
+		self.add(name, wall - nested[0], cpu - nested[1])
+
+		if len(self.nested):
+			self.nested[-1][0] += wall
+			self.nested[-1][1] += cpu
+
+	def report (self, ofd=sys.stderr):
+
+		ofd.write('%-16s %10s %10s\n' % ('phase', 'wall', 'cpu'))
+		for name in self.order:
+			wall, cpu = self.phases[name]
+			ofd.write('%-16s %9.3fs %9.3fs\n' % (name, wall, cpu))
+
+		if self.rss is not None:
+			ofd.write('%-16s %9.1fM\n' % ('peak rss', self.rss / 1048576.0))
+		if self.peak is not None:
+			ofd.write('%-16s %9.1fM\n' % ('peak traced', self.peak / 1048576.0))
+
+		for name in sorted(self.counters):
+			ofd.write('%-16s %10d\n' % (name, self.counters[name]))
+
+		# While streaming, rows are laid out and rendered together
+		rows = self.counters.get('rendered rows')
+		for name in ('render', 'stream'):
+			if rows and name in self.phases:
+				ofd.write('%-16s %9.1fus\n' % (name + ' per row', self.phases[name][0] / rows * 1e6))
+
+def _load_tracemalloc ():
+	try: import tracemalloc
+	except ImportError: return None
+	return tracemalloc
+
+def _load_resource ():
+	try: import resource
+	except ImportError: return None
+	return resource
+
+# The collector in use, if any. A caller can install its own, even a subclass
+# of Timings, before running the story, and read it afterwards
+active = None
+
+def enable (timings=None, memory=False):
+
+	global active
+	if active is None: active = timings or Timings(memory)
+	active.start()
+	return active
+
+def disable ():
+
+	global active
+	timings, active = active, None
+	if timings: timings.stop()
+	return timings
+
+@contextmanager
+def phase (name):
+
+	if active is None:
+		yield
+		return
+
+	timings = active
+	wall, cpu = timings.enter()
+	try: yield
+	finally: timings.leave(name, wall, cpu)
+
+def count (name, value=1):
+	if active is not None: active.count(name, value)
+
+# Time spent waiting for each element of the iterable is charged to the named
+# phase, as it is produced lazily by someone else
+def timed (name, iterable):
+
+	if active is None: return iterable
+	return _timed(active, name, iterable)
+
+def _timed (timings, name, iterable):
+
+	iterator = iter(iterable)
+	while True:
+
+		wall, cpu = timings.enter()
+		try: item = next(iterator)
+		except StopIteration:
+			timings.leave(name, wall, cpu)
+			return
+		timings.leave(name, wall, cpu)
+
+		yield item
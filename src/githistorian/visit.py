@@ -0,0 +1,27 @@
+# -*- encoding: utf-8 -*-
+
+from collections import deque
+
+# Visit order shared by all the passes over the graph. Elements are always
+# popped from the front; with prepend, pushed elements go to the front in their
+# own order and the visit proceeds depth-first, otherwise they are appended to
+# the back (in reverse order, if asked) and the visit proceeds breadth-first.
+# Both push and pop cost O(1) per element
+class VisitOrder:
+
+	def __init__ (self, prepend, reverse=False):
+		self.content = deque()
+		self.prepend = prepend
+		self.reverse = reverse
+
+	def has_more (self):
+		return len(self.content)
+
+	def push (self, arg):
+		if self.prepend: self.content.extendleft(reversed(arg))
+		elif self.reverse: self.content.extend(reversed(arg))
+		else: self.content.extend(arg)
+
+	def pop (self):
+		try: return self.content.popleft()
+		except IndexError: return None